@@ -21,14 +21,16 @@ mac_dst  = "50:c7:bf:ed:0a:54"
 ip_src   = "192.168.1.222"
 ip_dst   = "192.168.1.135"
 port_dst = 9999
+iface    = "enp0s31f6"
+inter    = 1  # Interval between packets, in seconds
 
 
 ### FUNCTIONS ###
 def main():
     port_src = random.randint(1024, 65535)
     packet = scapy.Ether(src=mac_src, dst=mac_dst) / scapy.IP(src=ip_src, dst=ip_dst) / scapy.TCP(sport=port_src, dport=port_dst, flags="S")
-    packet = packet.__class__(bytes(packet))
-    scapy.sendp(packet, iface="enp0s31f6", loop=1, inter=1, verbose=False)
+    raw = scapy.Raw(bytes(packet))
+    scapy.sendp(raw, iface=iface, loop=1, inter=inter, verbose=False)
 
 
 ### MAIN PROGRAM ###
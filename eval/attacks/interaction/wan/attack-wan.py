@@ -12,6 +12,10 @@ All packets should be blocked, as the prerequisite door state update pattern
 has not been seen beforehand.
 """
 
+import os
+import time
+import json
+import tempfile
 import scapy.all as scapy
 import random
 
@@ -21,6 +25,10 @@ mac_src     = "c0:56:27:73:46:0b"
 mac_dst     = "50:c7:bf:ed:0a:54"
 ip_dst      = "192.168.1.135"
 port_src    = 443
+iface       = "enp0s31f6"
+inter       = 1  # Interval between packets, in seconds
+cache_dir   = os.path.join(os.path.expanduser("~"), ".cache", "attack-wan")
+cache_ttl   = 300  # Validity of cached DNS answers, in seconds
 
 
 ### FUNCTIONS ###
@@ -43,18 +51,56 @@ def dns_query_server(qname: str) -> str:
         dns_answer_rr = dns_answer.lastlayer().an.getlayer(i)
 
 
+def read_cached_address(qname: str) -> str:
+    """
+    Read the IPv4 address for a domain name from the local DNS cache.
+
+    :param qname: The domain name to look up.
+    :return: The cached IPv4 address,
+             or None if it is not cached or the cache entry has expired.
+    """
+    cache_file = os.path.join(cache_dir, f"{qname}.json")
+    try:
+        if time.time() - os.path.getmtime(cache_file) > cache_ttl:
+            return None
+        with open(cache_file, "r") as f:
+            return json.load(f)["address"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_cached_address(qname: str, address: str) -> None:
+    """
+    Atomically write the IPv4 address for a domain name to the local DNS cache.
+
+    :param qname: The domain name.
+    :param address: The IPv4 address to cache.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"address": address, "timestamp": time.time()}, f)
+    os.replace(tmp_file, os.path.join(cache_dir, f"{qname}.json"))
+
+
 def main():
-    # Get the IPv4 address of the TP-Link cloud server
-    ip_src = dns_query_server(server_name)
-    print(f"Queried address for domain name \"{server_name}\": {ip_src}")
+    # Get the IPv4 address of the TP-Link cloud server,
+    # from the local cache if it has been queried recently
+    ip_src = read_cached_address(server_name)
+    if ip_src is None:
+        ip_src = dns_query_server(server_name)
+        print(f"Queried address for domain name \"{server_name}\": {ip_src}")
+        write_cached_address(server_name, ip_src)
+    else:
+        print(f"Cached address for domain name \"{server_name}\": {ip_src}")
 
     # Craft HTTPS packet towards the TP-Link smart plug
     port_dst = random.randint(1024, 65535)
     packet = scapy.Ether(src=mac_src, dst=mac_dst) / scapy.IP(src=ip_src, dst=ip_dst) / scapy.TCP(sport=port_src, dport=port_dst)
-    packet = packet.__class__(bytes(packet))
 
     # Send the HTTPS packet
-    scapy.sendp(packet, iface="enp0s31f6", loop=1, inter=1, verbose=False)
+    raw = scapy.Raw(bytes(packet))
+    scapy.sendp(raw, iface=iface, loop=1, inter=inter, verbose=False)
 
 
 ### MAIN PROGRAM ###
@@ -2,9 +2,7 @@
 
 import argparse
 import os
-import sys
-import re
-from inspect import getmembers, isfunction
+import importlib.util
 from pathlib import Path
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -15,6 +13,9 @@ import seaborn as sn
 script_name = os.path.basename(__file__)
 script_path = Path(os.path.abspath(__file__))
 script_dir = script_path.parents[0]
+# pyarrow is an optional dependency: parse CSV files with it if it is installed,
+# as it is faster than the default parser, and fall back to the default parser otherwise
+csv_engine = "pyarrow" if importlib.util.find_spec("pyarrow") is not None else "c"
 exp_cases = {
     "base": os.path.join(script_dir, "latency-base", "with-firewall"),
     "proto": os.path.join(script_dir, "proto", "latency"),
@@ -32,9 +33,9 @@ def build_df(exp_cases: dict) -> pd.DataFrame:
     :param exp_cases: dictionary of all experimental cases 
     :return: pandas DataFrame containing the latency data per attack type and scenario
     """
-    # Result DataFrame, will be populated
+    # Per-scenario DataFrames, will be populated
     columns = ["scenario", "latency"]
-    df = pd.DataFrame(columns=columns)
+    dfs = []
 
     # Iterate over devices and scenarios
     for scenario, scenario_path in exp_cases.items():
@@ -42,14 +43,17 @@ def build_df(exp_cases: dict) -> pd.DataFrame:
         if os.path.isdir(scenario_path) and len(os.listdir(scenario_path)) > 0:
             csv_file_name = "latency.csv"
             csv_file_path = os.path.join(scenario_path, csv_file_name)
-            scenario_df = pd.read_csv(csv_file_path)
+            scenario_df = pd.read_csv(csv_file_path, engine=csv_engine)
             tmp_df = pd.DataFrame({
                 "scenario": [scenario]*len(scenario_df),
-                "latency": scenario_df["latency"].apply(lambda x: x*1000)  # Convert to milliseconds
+                "latency": scenario_df["latency"] * 1000  # Convert to milliseconds
             })
-            df = pd.concat([df, tmp_df], ignore_index=True)
+            dfs.append(tmp_df)
     
-    return df
+    # Concatenate all scenarios at once
+    if not dfs:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(dfs, ignore_index=True)
 
 
 def bar_plot(df: pd.DataFrame, ax: plt.Axes) -> None:
@@ -136,6 +140,16 @@ def point_plot(df: pd.DataFrame, ax: plt.Axes) -> None:
     )
 
 
+# Mapping between plot types and plotting functions
+plotters = {
+    "bar": bar_plot,
+    "box": box_plot,
+    "violin": violin_plot,
+    "scatter": scatter_plot,
+    "point": point_plot
+}
+
+
 def plot(plot_type: str, df: pd.DataFrame, ax: plt.Axes) -> None:
     """
     Plot latency values for each device and scenario.
@@ -144,51 +158,31 @@ def plot(plot_type: str, df: pd.DataFrame, ax: plt.Axes) -> None:
     :param df: pandas DataFrame containing the latency data per device and scenario
     :param ax: matplotlib axes to plot on
     """
-    func = getattr(sys.modules[__name__], f"{plot_type}_plot")
-    func(df, ax)
+    plotters[plot_type](df, ax)
 
 
 def save_data(df: pd.DataFrame, is_median: bool, data_file: str) -> None:
     """
     Compute mean (or median) and 95-percentile interval of the latency,
-    per device and per scenario,
+    per scenario,
     and save the data to a CSV file.
 
-    :param df: pandas DataFrame containing the latency data per device and scenario
+    :param df: pandas DataFrame containing the latency data per scenario
     :param is_median: whether to compute median instead of mean
     :param data_file: file to save the data to
     """
-    all_scenarios = exp_cases["tplink-plug_tcp-flood"]
-    m_column = ["median"] if is_median else ["mean"]
-    data_columns = m_column + ["error_low", "error_high"]
-    columns = ["device_attack"]
-    for scenario in all_scenarios:
-        for data_column in data_columns:
-            columns.append(f"{scenario}_{data_column}")
-    result_dict = {key: [] for key in columns}
-
-    # Compute mean and 95-percentile interval of the latency
-    i = 1
-    for device_attack, scenarios in exp_cases.items():
-        result_dict["device_attack"].append(i)
-        for scenario in scenarios:
-            device_df = df[(df["device_attack"] == device_attack) & (df["scenario"] == scenario)]
-            val = None
-            name = ""
-            if is_median:
-                val = device_df["latency"].median()
-                name = "median"
-            else:
-                val = device_df["latency"].mean()
-                name = "mean"
-            result_dict[f"{scenario}_{name}"].append(val)
-            result_dict[f"{scenario}_error_low"].append(abs(val - device_df["latency"].quantile(0.025)))
-            result_dict[f"{scenario}_error_high"].append(abs(val - device_df["latency"].quantile(0.975)))
-        i += 1
+    m_column = "median" if is_median else "mean"
+
+    # Compute mean (or median) and 95-percentile interval of the latency,
+    # for all scenarios at once
+    grouped = df.groupby("scenario", sort=False)["latency"]
+    result_df = grouped.agg([m_column])
+    quantiles = grouped.quantile([0.025, 0.975]).unstack()
+    result_df["error_low"] = (result_df[m_column] - quantiles[0.025]).abs()
+    result_df["error_high"] = (result_df[m_column] - quantiles[0.975]).abs()
     
     # Write data to CSV file
-    result_df = pd.DataFrame(result_dict)
-    result_df.to_csv(data_file, index=False)
+    result_df.reset_index().to_csv(data_file, index=False)
 
 
 # Program entry point
@@ -204,9 +198,7 @@ if __name__ == "__main__":
     # Optional argument #2: plot or save plot data
     parser.add_argument("-d", "--data-file", type=str, help="Do not plot, but save plot data to given file")
     # Optional argument #3: plot type
-    pattern = re.compile(r"^(.*)_plot$")
-    plot_types = [func[0].split("_")[0] for func in getmembers(sys.modules[__name__], isfunction) if pattern.match(func[0]) is not None]
-    parser.add_argument("-p", "--plot-type", type=str, choices=plot_types, default="bar", help="Plot type")
+    parser.add_argument("-p", "--plot-type", type=str, choices=plotters.keys(), default="bar", help="Plot type")
     # Optional argument #4: file to save the plot to
     parser.add_argument("-f", "--file", type=str, help="File to save the plot to")
     # Parse arguments
@@ -22,14 +22,16 @@ ip_src   = "192.168.1.135"
 ip_dst   = "192.168.1.1"
 port_dst = 53
 qname    = "example.com"
+iface    = "enp0s31f6"
+inter    = 1  # Interval between packets, in seconds
 
 
 ### FUNCTIONS ###
 def main():
     port_src = random.randint(1024, 65535)
     packet = scapy.Ether(src=mac_src, dst=mac_dst) / scapy.IP(src=ip_src, dst=ip_dst) / scapy.UDP(sport=port_src, dport=port_dst) / scapy.DNS(rd=1, qd=scapy.DNSQR(qname=qname))
-    packet = packet.__class__(bytes(packet))
-    scapy.sendp(packet, iface="enp0s31f6", loop=1, inter=1, verbose=False)
+    raw = scapy.Raw(bytes(packet))
+    scapy.sendp(raw, iface=iface, loop=1, inter=inter, verbose=False)
 
 
 ### MAIN PROGRAM ###
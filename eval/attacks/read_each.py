@@ -1,10 +1,14 @@
 #!/usr/bin/python3
 
 import os
+import socket
+import struct
 from pathlib import Path
 import argparse
 from bisect import bisect
-import hashlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import xxhash
 import csv
 import scapy.all as scapy
 from typing import Tuple
@@ -22,6 +26,12 @@ all_dirs = [
     os.path.join(script_dir, "interaction", "wan", "latency"),
 ]
 all_pcaps = ["lan.pcap", "wlan2.4.pcap", "wlan5.0.pcap", "wan.pcap"]
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_ARP  = 0x0806
+# Pre-compiled structures for the headers which are parsed
+ETHER_HEADER = struct.Struct("!6s6sH")
+IPV4_HEADER  = struct.Struct("!BBHHHBBH4s4s")
+ARP_HEADER   = struct.Struct("!HHBBH6s4s6s4s")
 
 device = "tplink-plug"
 device_data = {
@@ -72,28 +82,85 @@ device_data = {
 }
 
 
-def get_packet_hash(packet: scapy.Packet) -> str:
+def get_packet_hash(raw: bytes) -> int:
     """
-    Compute the SHA256 hash value of a packet.
+    Compute the 64-bit xxHash3 value of a packet.
+    The hash is only used to match packets across PCAP files,
+    so a non-cryptographic hash is sufficient.
 
-    :param packet: packet to compute the hash for
-    :return: SHA256 hash value for the given packet
+    :param raw: raw bytes of the packet to compute the hash for
+    :return: 64-bit xxHash3 value for the given packet
     """
-    return hashlib.sha256(bytes(packet)).hexdigest()
+    return xxhash.xxh3_64_intdigest(raw)
 
 
-def search_packet(packets: list, timestamps: list, from_timestamp: float, hash: str) -> dict:
+def get_timestamp(pcap_reader: scapy.RawPcapReader, metadata: tuple) -> float:
     """
-    Search for a packet with the given hash in a list of packet hashes,
+    Get the timestamp of a packet from its PCAP or PCAPNG record metadata.
+
+    :param pcap_reader: raw reader the packet was read from
+    :param metadata: metadata of the packet record
+    :return: packet timestamp, in seconds
+    """
+    if isinstance(pcap_reader, scapy.RawPcapNgReader):
+        return ((metadata.tshigh << 32) + metadata.tslow) / metadata.tsresol
+    divisor = 10 ** 9 if pcap_reader.nano else 10 ** 6
+    return (metadata.sec * divisor + metadata.usec) / divisor
+
+
+def get_packet_summary(raw: bytes) -> str:
+    """
+    Get the scapy summary of a raw Ethernet frame.
+
+    :param raw: raw bytes of the Ethernet frame
+    :return: one-line summary of the packet
+    """
+    return scapy.Ether(raw).summary()
+
+
+def get_addresses(raw: bytes) -> Tuple[str, str, str]:
+    """
+    Get the source and destination addresses of a packet,
+    by unpacking the headers of the raw Ethernet frame,
+    without dissecting the packet.
+
+    :param raw: raw bytes of the Ethernet frame
+    :return: tuple containing the type of address (ipv4),
+             and the source and destination addresses,
+             or None if the packet contains neither an IPv4 or an ARP layer,
+             or if the frame is too short to contain the full header
+    """
+    if len(raw) < ETHER_HEADER.size:
+        # Frame is too short to contain an Ethernet header
+        return None
+    _, _, etype = ETHER_HEADER.unpack_from(raw)
+    if etype == ETHERTYPE_IPV4 and len(raw) >= ETHER_HEADER.size + IPV4_HEADER.size:
+        # Packet has an IPv4 layer
+        *_, src, dst = IPV4_HEADER.unpack_from(raw, ETHER_HEADER.size)
+        return "ipv4", socket.inet_ntoa(src), socket.inet_ntoa(dst)
+    elif etype == ETHERTYPE_ARP and len(raw) >= ETHER_HEADER.size + ARP_HEADER.size:
+        # Packet has an ARP layer
+        _, _, _, _, _, _, psrc, _, pdst = ARP_HEADER.unpack_from(raw, ETHER_HEADER.size)
+        return "ipv4", socket.inet_ntoa(psrc), socket.inet_ntoa(pdst)
+    else:
+        # Packet does not have a complete IPv4 or ARP layer
+        return None
+
+
+def search_packet(packets_by_hash: dict, from_timestamp: float, hash: int) -> dict:
+    """
+    Search for a non-initial packet with the given hash,
     starting from a given timestamp.
 
-    :param packets: list of packet hashes to search
+    :param packets_by_hash: dictionary mapping packet hashes to the list of
+                            non-initial packets with this hash, sorted by timestamp
     :param from_timestamp: timestamp from which to start searching
     :param hash: hash value of the packet to search for
     :return: dictionary containing packet data if found, None otherwise
     """
-    start_idx = bisect(timestamps, from_timestamp)
-    return next((packet for packet in packets[start_idx:] if packet["hash"] == hash and not packet["is_initial"]), None)
+    candidates = packets_by_hash.get(hash, [])
+    idx = bisect(candidates, from_timestamp, key=lambda packet: packet["timestamp"])
+    return candidates[idx] if idx < len(candidates) else None
 
 
 def is_addr_for_device(addr: str, device: str, protocol: str) -> bool:
@@ -136,30 +203,15 @@ def get_map_addr_pcap(protocol: str, this_device: str) -> dict:
     return map_addr_pcap
 
 
-def get_other_pcap(packet: scapy.Packet, maps_addr_pcap: dict) -> str:
+def get_other_pcap(protocol: str, dst: str, maps_addr_pcap: dict) -> str:
     """
     Get the other PCAP file corresponding to a given packet.
 
-    :param packet: packet to get the other PCAP file for
+    :param protocol: type of the packet addresses (mac, ipv4 or ipv6)
+    :param dst: destination address of the packet
     :param maps_addr_pcap: dictionary mapping addresses (MAC, IPv4 and IPv6) to PCAP files
-    :return: name of the other PCAP file,
-             or None if the packet contains neither an IP or an ARP layer
+    :return: name of the other PCAP file
     """
-    if packet.haslayer(scapy.IP):
-        # Packet has an IP layer
-        layer = packet.getlayer(scapy.IP)
-        protocol = f"ipv{layer.version}"
-        dst = layer.dst
-    elif packet.haslayer(scapy.ARP):
-        # Packet has an ARP layer
-        layer = packet.getlayer(scapy.ARP)
-        protocol = "ipv4"
-        dst = layer.pdst
-    else:
-        # Packet does not have IP or ARP layer
-        # Skip packet
-        return None
-    
     # Get the PCAP file corresponding to the destination IP address
     other_pcap = maps_addr_pcap[protocol].get(dst, None)
     if other_pcap is None:
@@ -168,19 +220,7 @@ def get_other_pcap(packet: scapy.Packet, maps_addr_pcap: dict) -> str:
         return other_pcap
     
 
-def is_duplicate(packet: dict, idx: int, packets: list) -> bool:
-    """
-    Check if the given packet is a duplicate of the previous one.
-
-    :param packet: given packet
-    :param idx: packet index
-    :param packets: list of packets
-    :return: True if the packet is a duplicate of the previous one, False otherwise
-    """
-    return packet["is_initial"] and idx > 0 and packet["hash"] == packets[idx - 1]["hash"]
-
-
-def read_packets_from_pcap(pcap_name: str, pcap_path: str, maps_addr_pcap: dict) -> Tuple[list, list]:
+def read_packets_from_pcap(pcap_name: str, pcap_path: str, maps_addr_pcap: dict) -> Tuple[list, dict]:
     """
     Read packets from a PCAP file,
     compute their hashes and store them in a list.
@@ -188,73 +228,81 @@ def read_packets_from_pcap(pcap_name: str, pcap_path: str, maps_addr_pcap: dict)
     :param pcap_name: name of the PCAP file
     :param pcap_path: full path to the PCAP file
     :param maps_addr_pcap: dictionary mapping addresses (MAC, IPv4 and IPv6) to PCAP files
-    :return: list of packets and list of timestamps
+    :return: list of packets, and dictionary mapping hashes to the non-initial packets with this hash
     """
     packets = []
-    timestamps = []
+    packets_by_hash = defaultdict(list)
     pcap_idx = 1
-    list_idx = 0
-    raw_packets = scapy.rdpcap(pcap_path)
-    for packet in raw_packets:
-
-        # Dictionary containing packet information
-        timestamp = float(packet.time)
-        packet_dict = {
-            "pcap_idx": pcap_idx,
-            "hash": get_packet_hash(packet),
-            "timestamp": timestamp,
-            "packet": packet,
-            "is_initial": False
-        }
-
-        # Get packet source and destination addresses
-        if packet.haslayer(scapy.IP):
-            # Packet has an IP layer
-            layer = packet.getlayer(scapy.IP)
-            protocol = f"ipv{layer.version}"
-            src = layer.src
-            dst = layer.dst
-        elif packet.haslayer(scapy.ARP):
-            # Packet has an ARP layer
-            layer = packet.getlayer(scapy.ARP)
-            protocol = "ipv4"
-            src = layer.psrc
-            dst = layer.pdst
-        else:
-            # Packet does not have IP or ARP layer
-            # Skip packet
-            pcap_idx += 1
-            continue
-
-        # If packet source or destination address is well-known,
-        # and its base PCAP is the current one,
-        # compute packet hash and add it to resulting list.
-        src_base_pcap = maps_addr_pcap[protocol].get(src, None)
-        dst_base_pcap = maps_addr_pcap[protocol].get(dst, None)
-        if src_base_pcap == pcap_name or dst_base_pcap == pcap_name:
-            packet_dict["is_initial"] = src_base_pcap == pcap_name
-            if not is_duplicate(packet_dict, list_idx, packets):
-                # If packet is not a duplicate,
-                # append it to list
-                packets.append(packet_dict)
-                timestamps.append(timestamp)
-                list_idx += 1
+    last_hash = None  # Hash of the last packet added to the list
+
+    # Sets of addresses for which the current PCAP is the base PCAP,
+    # and of all well-known addresses, per type of address
+    pcap_addrs = {
+        protocol: frozenset(addr for addr, pcap in map_addr_pcap.items() if pcap == pcap_name)
+        for protocol, map_addr_pcap in maps_addr_pcap.items()
+    }
+    known_addrs = {protocol: frozenset(map_addr_pcap) for protocol, map_addr_pcap in maps_addr_pcap.items()}
+    is_wan = pcap_name == "wan.pcap"
+
+    # Read raw records, without dissecting packets
+    with scapy.RawPcapReader(pcap_path) as pcap_reader:
+        for raw, metadata in pcap_reader:
+
+            # Get packet source and destination addresses
+            addresses = get_addresses(raw)
+            if addresses is None:
+                # Packet does not have IP or ARP layer
+                # Skip packet
+                pcap_idx += 1
+                continue
+            protocol, src, dst = addresses
+
+            # Dictionary containing packet information,
+            # only built for packets which are not skipped
+            packet_dict = {
+                "pcap_idx": pcap_idx,
+                "hash": get_packet_hash(raw),
+                "timestamp": get_timestamp(pcap_reader, metadata),
+                "raw": raw,
+                "protocol": protocol,
+                "dst": dst,
+                "is_initial": False
+            }
+
+            # If packet source or destination address is well-known,
+            # and its base PCAP is the current one,
+            # compute packet hash and add it to resulting list.
+            src_is_here = src in pcap_addrs[protocol]
+            dst_is_here = dst in pcap_addrs[protocol]
+            if src_is_here or dst_is_here:
+                packet_dict["is_initial"] = src_is_here
+                if not (packet_dict["is_initial"] and packet_dict["hash"] == last_hash):
+                    # If packet is not a duplicate of the previous one,
+                    # append it to list
+                    packets.append(packet_dict)
+                    if not packet_dict["is_initial"]:
+                        packets_by_hash[packet_dict["hash"]].append(packet_dict)
+                    last_hash = packet_dict["hash"]
         
-        # If packet source or destination address is not known,
-        # and the current PCAP is for the WAN,
-        # compute packet hash and add it to resulting list.
-        if (src_base_pcap is None or dst_base_pcap is None) and pcap_name == "wan.pcap":
-            packet_dict["is_initial"] = src_base_pcap is None
-            if not is_duplicate(packet_dict, list_idx, packets):
-                # If packet is not a duplicate,
-                # append it to list
-                packets.append(packet_dict)
-                timestamps.append(timestamp)
-                list_idx += 1
+            # If packet source or destination address is not known,
+            # and the current PCAP is for the WAN,
+            # compute packet hash and add it to resulting list.
+            if is_wan:
+                src_is_known = src in known_addrs[protocol]
+                dst_is_known = dst in known_addrs[protocol]
+                if not src_is_known or not dst_is_known:
+                    packet_dict["is_initial"] = not src_is_known
+                    if not (packet_dict["is_initial"] and packet_dict["hash"] == last_hash):
+                        # If packet is not a duplicate of the previous one,
+                        # append it to list
+                        packets.append(packet_dict)
+                        if not packet_dict["is_initial"]:
+                            packets_by_hash[packet_dict["hash"]].append(packet_dict)
+                        last_hash = packet_dict["hash"]
 
-        pcap_idx += 1
+            pcap_idx += 1
 
-    return packets, timestamps
+    return packets, packets_by_hash
 
 
 
@@ -294,12 +342,17 @@ if __name__ == "__main__":
     for scenario_dir in all_dirs:
 
         ## Preprocessing
-        # Compute hash values for each packet in each PCAP file
+        # Compute hash values for each packet in each PCAP file,
+        # parsing the PCAP files in parallel
         packets = {}
-        timestamps = {}
-        for pcap in all_pcaps:
-            pcap_path = os.path.join(scenario_dir, pcap)
-            packets[pcap], timestamps[pcap] = read_packets_from_pcap(pcap, pcap_path, maps_addr_pcap)
+        packets_by_hash = {}
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = {}
+            for pcap in all_pcaps:
+                pcap_path = os.path.join(scenario_dir, pcap)
+                futures[pcap] = executor.submit(read_packets_from_pcap, pcap, pcap_path, maps_addr_pcap)
+            for pcap, future in futures.items():
+                packets[pcap], packets_by_hash[pcap] = future.result()
 
         # Initialize CSV result file
         result_file_path = os.path.join(scenario_dir, "latency.csv")
@@ -307,7 +360,10 @@ if __name__ == "__main__":
             fieldnames = ["hash", "base_pcap", "base_id", "base_packet", "base_timestamp", "other_pcap", "other_id", "other_packet", "other_timestamp", "latency"]
             writer = csv.DictWriter(f, fieldnames=fieldnames)
             writer.writeheader()
-            csv_packets = {}  # Resulting dict, will be populated by parsing
+            # Resulting dict, will be populated by parsing.
+            # Maps each matched packet of the other PCAP, identified by its PCAP and index,
+            # to the row with the lowest latency for this packet.
+            best_rows = {}
 
             # Iterate on PCAP files
             for pcap in all_pcaps:
@@ -320,45 +376,43 @@ if __name__ == "__main__":
                         continue
 
                     result_dict = {
-                        "hash": packet["hash"],
+                        "hash": f"{packet['hash']:016x}",
                         "base_pcap": pcap,
                         "base_id": packet["pcap_idx"],
-                        "base_packet": packet["packet"],
+                        "base_packet": packet["raw"],
                         "base_timestamp": packet["timestamp"]
                     }
                     
                     # Get other PCAP to search for the corresponding packet
-                    other_pcap = get_other_pcap(packet["packet"], maps_addr_pcap)
-                    if other_pcap is not None:
-                        # Search other PCAP for a matching packet
-                        other_pcap_path = os.path.join(scenario_dir, other_pcap)
-                        other_packet = search_packet(packets[other_pcap], timestamps[other_pcap], packet["timestamp"], packet["hash"])
-                        if other_packet is not None and not other_packet["is_initial"]:
-                            # Corresponding packet was found
-                            
-                            # Get old and new latency
-                            old_latency = other_packet.get("latency", float("inf"))
-                            new_latency = abs(packet["timestamp"] - other_packet["timestamp"])
-
-                            if new_latency <= old_latency:
-
-                                # Build dictionary containing packet data
-                                other_packet["latency"] = new_latency
-                                result_dict["other_pcap"] = other_pcap
-                                result_dict["other_id"] = other_packet["pcap_idx"]
-                                result_dict["other_packet"] = other_packet["packet"]
-                                other_timestamp = other_packet["timestamp"]
-                                result_dict["other_timestamp"] = other_timestamp
-                                result_dict["latency"] = new_latency
-
-                                # Remove old entry from CSV dict
-                                old_key = (packet["hash"], old_latency)
-                                csv_packets.pop(old_key, None)
-
-                                # Add new entry to CSV dict
-                                new_key = (packet["hash"], new_latency)
-                                csv_packets[new_key] = result_dict
+                    other_pcap = get_other_pcap(packet["protocol"], packet["dst"], maps_addr_pcap)
+
+                    # Search other PCAP for a matching packet
+                    other_packet = search_packet(packets_by_hash[other_pcap], packet["timestamp"], packet["hash"])
+                    if other_packet is not None:
+                        # Corresponding packet was found
+                        
+                        # Get old and new latency
+                        old_latency = other_packet.get("latency", float("inf"))
+                        new_latency = abs(packet["timestamp"] - other_packet["timestamp"])
+
+                        if new_latency <= old_latency:
+
+                            # Build dictionary containing packet data
+                            other_packet["latency"] = new_latency
+                            result_dict["other_pcap"] = other_pcap
+                            result_dict["other_id"] = other_packet["pcap_idx"]
+                            result_dict["other_packet"] = other_packet["raw"]
+                            other_timestamp = other_packet["timestamp"]
+                            result_dict["other_timestamp"] = other_timestamp
+                            result_dict["latency"] = new_latency
+
+                            # Replace the previous entry for the matched packet, if any
+                            best_rows[(other_pcap, other_packet["pcap_idx"])] = result_dict
         
-            writer.writerows(csv_packets.values())
+            # Write rows, dissecting only the packets which are written
+            for result_dict in best_rows.values():
+                result_dict["base_packet"] = get_packet_summary(result_dict["base_packet"])
+                result_dict["other_packet"] = get_packet_summary(result_dict["other_packet"])
+            writer.writerows(best_rows.values())
         
         print(f"Result file written to {result_file_path}.")
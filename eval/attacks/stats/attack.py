@@ -19,13 +19,15 @@ sha = "3c:cd:5d:a2:a9:d7"
 tha = "00:00:00:00:00:00"
 spa = "192.168.1.222"
 tpa = "192.168.1.135"
+iface = "enp0s31f6"
+inter = 0.1  # Interval between packets, in seconds
 
 
 ### FUNCTIONS ###
 def main():
     packet = scapy.Ether(src=sha, dst=eth_broadcast) / scapy.ARP(op=1, hwsrc=sha, hwdst=tha, psrc=spa, pdst=tpa)
-    packet = packet.__class__(bytes(packet))
-    scapy.sendp(packet, iface="enp0s31f6", loop=1, inter=0.1, verbose=False)
+    raw = scapy.Raw(bytes(packet))
+    scapy.sendp(raw, iface=iface, loop=1, inter=inter, verbose=False)
 
 
 ### MAIN PROGRAM ###
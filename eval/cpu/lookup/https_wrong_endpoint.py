@@ -14,6 +14,10 @@ Packets have the following signature:
 All packets should be blocked.
 """
 
+import os
+import time
+import socket
+import ctypes
 import scapy.all as scapy
 import random
 
@@ -23,19 +27,100 @@ mac_gateway = "c0:56:27:73:46:0b"
 ip_plug     = "192.168.1.135"
 ip_wrong    = "192.18.1.2"
 port_https  = 443
+iface       = "enp0s31f6"
+inter       = 0.001  # Interval between packets, in seconds
+batch_size  = 64     # Number of packets sent per sendmmsg call
+ETH_P_ALL   = 0x0003
 
 
 ### FUNCTIONS ###
 
+class IOVec(ctypes.Structure):
+    """
+    C `struct iovec`.
+    """
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len",  ctypes.c_size_t)
+    ]
+
+
+class MsgHdr(ctypes.Structure):
+    """
+    C `struct msghdr`.
+    """
+    _fields_ = [
+        ("msg_name",       ctypes.c_void_p),
+        ("msg_namelen",    ctypes.c_uint32),
+        ("msg_iov",        ctypes.POINTER(IOVec)),
+        ("msg_iovlen",     ctypes.c_size_t),
+        ("msg_control",    ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags",      ctypes.c_int)
+    ]
+
+
+class MMsgHdr(ctypes.Structure):
+    """
+    C `struct mmsghdr`, as used by `sendmmsg`.
+    """
+    _fields_ = [
+        ("msg_hdr", MsgHdr),
+        ("msg_len", ctypes.c_uint)
+    ]
+
+
+def build_msgvec(buffer: ctypes.Array, n: int) -> ctypes.Array:
+    """
+    Build an array of `n` message headers,
+    all pointing to the same frame buffer.
+
+    :param buffer: buffer containing the raw frame to send
+    :param n: number of messages in the array
+    :return: array of `struct mmsghdr` to pass to `sendmmsg`
+    """
+    iov = IOVec(ctypes.cast(buffer, ctypes.c_void_p), len(buffer))
+    msgvec = (MMsgHdr * n)()
+    for msg in msgvec:
+        msg.msg_hdr.msg_iov = ctypes.pointer(iov)
+        msg.msg_hdr.msg_iovlen = 1
+    return msgvec
+
+
 def main():
 
     # Craft HTTPS packet towards the incorrect address
     port_plug = random.randint(1024, 65535)
     packet = scapy.Ether(src=mac_plug, dst=mac_gateway) / scapy.IP(src=ip_plug, dst=ip_wrong) / scapy.TCP(sport=port_plug, dport=port_https)
-    packet = packet.__class__(bytes(packet))
 
-    # Send the HTTPS packet
-    scapy.sendp(packet, iface="enp0s31f6", loop=1, inter=0.001, verbose=False)
+    # Prepare a batch of copies of the raw frame
+    raw = bytes(packet)
+    buffer = ctypes.create_string_buffer(raw, len(raw))
+    msgvec = build_msgvec(buffer, batch_size)
+    libc = ctypes.CDLL("libc.so.6", use_errno=True)
+
+    # Send the HTTPS packet in batches, over a single raw socket.
+    # Pace batches on a monotonic deadline to keep the average rate at 1 / inter.
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    sock.bind((iface, 0))
+    try:
+        deadline = time.monotonic()
+        while True:
+            sent = 0
+            while sent < batch_size:
+                ret = libc.sendmmsg(sock.fileno(), ctypes.byref(msgvec, sent * ctypes.sizeof(MMsgHdr)), batch_size - sent, 0)
+                if ret < 0:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, os.strerror(errno))
+                sent += ret
+            deadline += batch_size * inter
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
 
 
 
@@ -13,6 +13,37 @@ script_name = os.path.basename(__file__)
 script_path = Path(os.path.abspath(__file__))
 script_dir = script_path.parents[0]
 data_file = os.path.join(script_dir, "metrics.csv")
+scenarios = ["normal", "state", "string", "lookup"]  # Plotting order
+
+
+def bar_plot(ax: plt.Axes, df: pd.DataFrame, y: str) -> None:
+    """
+    Plot the mean of a metric per scenario as a bar plot,
+    with its 95-percentile interval as error bars.
+    Aggregates are computed once with pandas.
+
+    :param ax: matplotlib axes to plot on
+    :param df: pandas DataFrame containing the metrics per scenario
+    :param y: name of the column containing the metric to plot
+    """
+    grouped = df.groupby("scenario", observed=True)[y]
+    mean = grouped.mean()
+    low, high = grouped.quantile(0.025), grouped.quantile(0.975)
+    x = range(len(mean))
+    ax.bar(x, mean, color=sn.color_palette(n_colors=len(mean)))
+    # The interval does not always contain the mean,
+    # so error bars are centered on the interval itself
+    ax.errorbar(
+        x,
+        (low + high) / 2,
+        yerr       = (high - low) / 2,
+        fmt        = "none",
+        ecolor     = ".26",
+        elinewidth = 1,
+        capsize    = 3
+    )
+    ax.set_xticks(x)
+    ax.set_xticklabels([scenario.capitalize() for scenario in mean.index])
 
 
 ##### MAIN #####
@@ -27,36 +58,33 @@ if __name__ == "__main__":
     parser.add_argument("-f", "--file", type=str, help="File to save the plot to")
     args = parser.parse_args()
 
-    # Read CSV data file
-    df = pd.read_csv(os.path.join(script_dir, data_file))
+    # Read CSV data file, only parsing plotted columns
+    df = pd.read_csv(
+        data_file,
+        usecols = ["scenario", "cpu", "memory_percentage"],
+        dtype   = {
+            "scenario": pd.CategoricalDtype(scenarios, ordered=True),
+            "cpu": "float32",
+            "memory_percentage": "float32"
+        }
+    )
 
 
     ### PLOT ###
 
     # Initialize plot
-    fig, axes = plt.subplots(1, 2, figsize=(6, 4))
+    fig, axes = plt.subplots(1, 2, figsize=(6, 4), constrained_layout=True)
 
     # Left plot: CPU usage percentage
-    sn.barplot(
-        ax       = axes[0],
-        data     = df,
-        x        = "scenario",
-        y        = "cpu",
-        errorbar = "pi",
-        errwidth = 1,
-        capsize  = 0.1
-    )
+    bar_plot(axes[0], df, "cpu")
 
     # Right plot: memory usage percentage
-    sn.barplot(
-        ax       = axes[1],
-        data     = df,
-        x        = "scenario",
-        y        = "memory_percentage",
-        errorbar = "pi",
-        errwidth = 1,
-        capsize  = 0.1
-    )
+    bar_plot(axes[1], df, "memory_percentage")
+
+    # Rasterize bars and error bars, keeping axes and labels as vector graphics
+    for ax in axes:
+        for artist in ax.patches + ax.collections + ax.lines:
+            artist.set_rasterized(True)
 
     ## Plot metadata
     # Global title
@@ -64,16 +92,12 @@ if __name__ == "__main__":
     # Left plot
     axes[0].set_xlabel("Scenario")
     axes[0].set_ylabel("CPU usage [%]")
-    xlabels = ["Normal", "State", "String", "Lookup"]
-    axes[0].set_xticklabels(xlabels)
     # Right plot
     axes[1].set_xlabel("Scenario")
     axes[1].set_ylabel("Memory usage [%]")
-    axes[1].set_xticklabels(xlabels)
 
     # Show or save plot
-    fig.tight_layout()
     if args.file:
-        fig.savefig(args.file)
+        fig.savefig(args.file, dpi=200)
     else:
         plt.show()
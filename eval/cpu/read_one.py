@@ -4,7 +4,6 @@ import os
 from pathlib import Path
 import argparse
 import csv
-import subprocess
 
 
 ### GLOBAL VARIABLES ###
@@ -12,6 +11,27 @@ script_name = os.path.basename(__file__)
 script_path = Path(os.path.abspath(__file__))
 script_dir = script_path.parents[0]
 process_name = "nfqueue"
+fieldnames = ["scenario", "iteration", "cpu", "memory_size", "memory_percentage"]
+
+
+def parse_top(raw_file_path: str, scenario: str):
+    """
+    Extract CPU and memory metrics of the process from a raw `top` output file.
+
+    :param raw_file_path: path to the raw file containing the `top` output
+    :param scenario: name of the scenario the metrics belong to
+    :return: generator of tuples containing the metrics, one per relevant line,
+             with values in the order of `fieldnames`
+    """
+    with open(raw_file_path, "r") as raw_file:
+
+        # Iterate over relevant lines of the raw file
+        filtered_lines = (line for line in raw_file if process_name in line)
+        for i, line in enumerate(filtered_lines):
+
+            # Get values
+            split = line.split()
+            yield (scenario, i, split[6].rstrip("%"), split[4], split[5].rstrip("%"))
 
 
 ##### MAIN #####
@@ -29,32 +49,14 @@ if __name__ == "__main__":
     raw_file_path = os.path.join(script_dir, args.raw_file)
     raw_file_dir = os.path.dirname(raw_file_path)
 
-    # Extract only relevant lines from raw file
-    filtered_file_path = os.path.join(raw_file_dir, "filtered.txt")
-    cmd = f"grep {process_name} \"{raw_file_path}\" > \"{filtered_file_path}\""
-    subprocess.run(cmd, shell=True)
-
     # Result CSV file
     result_file_path = os.path.join(raw_file_dir, "metrics.csv")
     
-    with open(filtered_file_path, "r") as filtered_file:
-        with open(result_file_path, "w") as result_file:
-
-            # Initialize CSV writer
-            fieldnames = ["scenario", "iteration", "cpu", "memory_size", "memory_percentage"]
-            writer = csv.DictWriter(result_file, fieldnames=fieldnames)
-            writer.writeheader()
-
-            # Iterate over raw file
-            for i, line in enumerate(filtered_file):
-
-                # Get and write values
-                split = line.strip().split()
-                values = {
-                    "scenario": os.path.basename(raw_file_dir),
-                    "iteration": i,
-                    "memory_size": split[4],
-                    "memory_percentage": split[5].replace("%", ""),
-                    "cpu": split[6].replace("%", ""),
-                }
-                writer.writerow(values)
+    with open(result_file_path, "w") as result_file:
+
+        # Initialize CSV writer
+        writer = csv.writer(result_file)
+        writer.writerow(fieldnames)
+
+        # Write values
+        writer.writerows(parse_top(raw_file_path, os.path.basename(raw_file_dir)))
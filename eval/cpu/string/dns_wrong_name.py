@@ -13,8 +13,12 @@ Packets have the following signature:
 All packets should be blocked.
 """
 
+import os
+import time
+import socket
+import struct
+import itertools
 import scapy.all as scapy
-import random
 
 ### GLOBAL VARIABLES ###
 mac_src     = "50:c7:bf:ed:0a:54"
@@ -23,19 +27,71 @@ ip_src      = "192.168.1.135"
 ip_dst      = "192.168.1.1"
 port_dst    = 53
 qname       = "eu.pool.ntp.com"
+iface       = "enp0s31f6"
+inter       = 0.001  # Interval between packets, in seconds
+ETH_P_ALL   = 0x0003
+UDP_OFFSET  = 14 + 20  # Offset of the UDP header in the frame (Ethernet + IPv4 without options)
+n_ports     = 4096     # Number of pre-drawn random source ports
 
 
 ### FUNCTIONS ###
 
+def random_ports(n: int) -> list:
+    """
+    Draw random source ports in the range [1024, 65535],
+    from a single read of the system's random source.
+
+    :param n: number of ports to draw
+    :return: list of random ports
+    """
+    return [1024 + value % 64512 for value in struct.unpack(f"!{n}H", os.urandom(2 * n))]
+
+
+def patch_source_port(frame: bytearray, port: int) -> None:
+    """
+    Replace the UDP source port of a raw frame in place,
+    and incrementally update the UDP checksum accordingly (RFC 1624).
+
+    :param frame: raw Ethernet frame containing an IPv4 / UDP packet
+    :param port: new UDP source port
+    """
+    old_port, = struct.unpack_from("!H", frame, UDP_OFFSET)
+    checksum, = struct.unpack_from("!H", frame, UDP_OFFSET + 6)
+    total = (~checksum & 0xFFFF) + (~old_port & 0xFFFF) + port
+    total = (total & 0xFFFF) + (total >> 16)
+    total = (total & 0xFFFF) + (total >> 16)
+    checksum = (~total & 0xFFFF) or 0xFFFF
+    struct.pack_into("!H", frame, UDP_OFFSET, port)
+    struct.pack_into("!H", frame, UDP_OFFSET + 6, checksum)
+
+
 def main():
 
     # Craft DNS query towards the gateway
-    port_src = random.randint(1024, 65535)
+    ports = itertools.cycle(random_ports(n_ports))
+    port_src = next(ports)
     dns_query = scapy.Ether(src=mac_src, dst=mac_dst) / scapy.IP(src=ip_src, dst=ip_dst) / scapy.UDP(sport=port_src, dport=53) / scapy.DNS(rd=1, qd=scapy.DNSQR(qname=qname))
-    dns_query = dns_query.__class__(bytes(dns_query))
+    raw = bytearray(bytes(dns_query))  # Build the frame once: scapy computes lengths and the UDP checksum, which patch_source_port then updates
 
-    # Send the DNS query
-    scapy.sendp(dns_query, iface="enp0s31f6", loop=1, inter=0.001, verbose=False)
+    # Send the DNS query in a loop, over a single raw socket.
+    # Pace on a monotonic deadline rather than sleeping a fixed interval,
+    # as sleep jitter is of the same order as the 1 ms interval.
+    # Each query is sent from a new source port, patched directly in the raw frame.
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    sock.bind((iface, 0))
+    try:
+        deadline = time.monotonic()
+        while True:
+            sock.send(raw)
+            patch_source_port(raw, next(ports))
+            deadline += inter
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
 
 
 ### MAIN ###
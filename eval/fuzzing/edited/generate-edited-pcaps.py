@@ -7,11 +7,11 @@ Generate edited PCAPs for firewall evaluation.
 # Import libraries
 import os
 from pathlib import Path
-import glob
-import shutil
 import argparse
 import json
 import logging
+import random
+from concurrent.futures import ProcessPoolExecutor
 import pcap_fuzzer  # Custom PCAP fuzzing library
 
 
@@ -45,10 +45,6 @@ if __name__ == "__main__":
     base_dir = script_path.parents[3]
     devices_dir = os.path.join(base_dir, "devices")
 
-    ### LOGGING CONFIGURATION ###
-    logging.basicConfig(level=logging.INFO)
-    logging.info(f"Starting {script_name}")
-
     ### ARGUMENT PARSING ###
     parser = argparse.ArgumentParser(
         prog=script_name,
@@ -57,8 +53,15 @@ if __name__ == "__main__":
     # Optional flag: -n, --number-pcaps
     parser.add_argument("-n", "--number-pcaps", type=strictly_positive_int, default=5,
                         help="Number of edited PCAPs to generate per original PCAP. Must be a strictly positive integer. Default: 5.")
+    # Optional flag: -v, --verbose
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Log progress messages. Default: only log warnings and errors.")
     args = parser.parse_args()
 
+    ### LOGGING CONFIGURATION ###
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    logging.info("Starting %s", script_name)
+
     ### READ DATA ###
     # Device PCAPs
     device_pcaps = {}
@@ -70,32 +73,57 @@ if __name__ == "__main__":
 
     ### MAIN PROGRAM ###
 
-    # Loop on devices
-    for device, pcaps in device_pcaps.items():
-        device_dir = os.path.join(devices_dir, device)
+    # Generate edited PCAPs in parallel.
+    # Workers are reseeded, as forked processes would otherwise share the same random state.
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=random.seed) as executor:
+        futures = {}
 
-        # Loop on PCAPs
-        for pcap in pcaps:
-            pcap_path = os.path.join(device_dir, "traces", pcap)
-            pcap_edited_dir = os.path.join(device_dir, "traces", "edited")
+        # Loop on devices
+        for device, pcaps in device_pcaps.items():
+            device_dir = os.path.join(devices_dir, device)
+            traces_dir = os.path.join(device_dir, "traces")
+            pcap_edited_dir = os.path.join(traces_dir, "edited")
             pcap_edited_csv_dir = os.path.join(pcap_edited_dir, "csv")
-            os.makedirs(pcap_edited_csv_dir, exist_ok=True)
             pcap_edited_pcap_dir = os.path.join(pcap_edited_dir, "pcap")
-            os.makedirs(pcap_edited_pcap_dir, exist_ok=True)
-
-            # Generate edited PCAPs
-            for i in range(1, args.number_pcaps + 1):
-                pcap_edited_basename = os.path.basename(pcap_path).replace(".pcap", f".edit-{i}.pcap")
-                pcap_edited_path = os.path.join(pcap_edited_dir, pcap_edited_basename)
-
-                # Generate edited PCAP
-                pcap_fuzzer.fuzz_pcaps(pcaps=pcap_path, output=pcap_edited_path, random_range=5)
-                logging.info(f"Generated edited PCAP {pcap_edited_basename}.")
-
-            # Move files to correct directories
-            for file in glob.glob(os.path.join(pcap_edited_dir, "*.csv")):
-                shutil.copy(file, pcap_edited_csv_dir)
-                os.remove(file)
-            for file in glob.glob(os.path.join(pcap_edited_dir, "*.pcap")):
-                shutil.copy(file, pcap_edited_pcap_dir)
-                os.remove(file)
+            if pcaps:
+                os.makedirs(pcap_edited_csv_dir, exist_ok=True)
+                os.makedirs(pcap_edited_pcap_dir, exist_ok=True)
+
+            # Loop on PCAPs
+            for pcap in pcaps:
+                pcap_path = os.path.join(traces_dir, pcap)
+
+                # Skip missing or empty PCAPs
+                if not os.path.isfile(pcap_path) or os.path.getsize(pcap_path) == 0:
+                    logging.warning("Skipping missing or empty PCAP %s.", pcap_path)
+                    continue
+
+                # Submit edited PCAP generation
+                pcap_stem = pcap.replace(".pcap", "")
+                for i in range(1, args.number_pcaps + 1):
+                    pcap_edited_basename = f"{pcap_stem}.edit-{i}.pcap"
+                    pcap_edited_path = os.path.join(pcap_edited_dir, pcap_edited_basename)
+                    future = executor.submit(pcap_fuzzer.fuzz_pcaps, pcaps=pcap_path, output=pcap_edited_path, random_range=5)
+                    futures[future] = pcap_edited_basename
+
+        # Wait for edited PCAPs to be generated
+        for future, pcap_edited_basename in futures.items():
+            future.result()
+            logging.info("Generated edited PCAP %s.", pcap_edited_basename)
+
+    # Move files to correct directories, once per device
+    for device, pcaps in device_pcaps.items():
+        if not pcaps:
+            continue
+        device_dir = os.path.join(devices_dir, device)
+        pcap_edited_dir = os.path.join(device_dir, "traces", "edited")
+        pcap_edited_csv_dir = os.path.join(pcap_edited_dir, "csv")
+        pcap_edited_pcap_dir = os.path.join(pcap_edited_dir, "pcap")
+        with os.scandir(pcap_edited_dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith(".csv"):
+                    os.replace(entry.path, os.path.join(pcap_edited_csv_dir, entry.name))
+                elif entry.name.endswith(".pcap"):
+                    os.replace(entry.path, os.path.join(pcap_edited_pcap_dir, entry.name))
@@ -7,11 +7,25 @@ Indicate, for each packet, if it should have been accepted or dropped.
 
 ## Import libraries
 import os
+import sys
 from pathlib import Path
-import json
+from typing import NamedTuple
+from dataclasses import dataclass
 import csv
+import bisect
+import heapq
+import operator
 import yaml
 import logging
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+# Use orjson to parse JSON if available, as it is faster than the standard library
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    import json
+    json_loads = json.loads
 # Import custom PyYAML loader
 from pyyaml_loaders import IncludeLoader
 
@@ -42,6 +56,8 @@ DNS_RR_TYPES = {
     41:  "OPT",
     255: "ANY"
 }
+# DNS RR type codes, indexed by type name
+DNS_RR_TYPE_CODES = {name: code for code, name in DNS_RR_TYPES.items()}
 
 
 def get_packets_by_timestamp(packet_list: list, packet_timestamp: any) -> list:
@@ -82,6 +98,18 @@ def get_packet_by_id(packet_list: list, packet_id: any) -> bool:
     return next((packet for packet in packet_list if int(packet["id"]) == packet_id), None)
     
 
+def parse_policy(policy: str) -> tuple:
+    """
+    Split the given policy into its interaction and policy names.
+
+    :param policy: Policy to parse, formatted as `interaction#policy`.
+    :return: Tuple (interaction name, policy name),
+             or None if the policy is the default drop policy.
+    """
+    split = policy.split("#")
+    return tuple(split) if len(split) == 2 else None
+
+
 def is_default_drop(policy: str) -> bool:
     """
     Check if the given policy is the default drop policy.
@@ -121,6 +149,43 @@ def is_same_policy(policy_a: str, policy_b: str) -> bool:
     return policy_a in policy_b or policy_b in policy_a
 
 
+def same_interaction_rows(interaction_name: str, policy_name: str, interaction_rows: dict, single_policy_rows: dict) -> list:
+    """
+    Get the sorted row index lists which are in the same interaction as the given policy,
+    i.e. the rows of the same interaction and the rows of matching single policies.
+    This is equivalent to filtering all rows with `is_same_interaction`,
+    but only depends on the policy, and can therefore be computed once per policy.
+
+    :param interaction_name: Interaction of the policy.
+    :param policy_name: Name of the policy.
+    :param interaction_rows: Sorted row indices per interaction, without default drop rows.
+    :param single_policy_rows: Sorted row indices per single policy.
+    :return: List of sorted row index lists in the same interaction as the given policy.
+    """
+    indices_lists = [interaction_rows.get(interaction_name, [])]
+    if interaction_name != "single":
+        indices_lists += [indices for single_policy_name, indices in single_policy_rows.items()
+                          if is_same_policy(single_policy_name, policy_name)]
+    return indices_lists
+
+
+def previous_rows_in_interaction(row_idx: int, indices_lists: list) -> iter:
+    """
+    Iterate backwards over the indices of the rows preceding the given one
+    in the given sorted row index lists.
+
+    :param row_idx: Index of the current row.
+    :param indices_lists: Sorted row index lists, as returned by `same_interaction_rows`.
+    :return: Iterator over the indices of the previous rows, in decreasing order.
+    """
+    iterators = [map(indices.__getitem__, range(bisect.bisect_left(indices, row_idx) - 1, -1, -1))
+                 for indices in indices_lists]
+    if len(iterators) == 1:
+        # No matching single policy, no need to merge
+        return iterators[0]
+    return heapq.merge(*iterators, reverse=True)
+
+
 def deep_get(d: dict, key: str, top_key: str = None) -> any:
     """
     Retrieve the value corresponding to the given key in the given nested dictionary.
@@ -144,21 +209,25 @@ def deep_get(d: dict, key: str, top_key: str = None) -> any:
         return d[key]
     
 
-def flatten_policies(single_policy_name: str, single_policy: dict, acc: dict = {}) -> None:
+def flatten_policies(single_policy_name: str, single_policy: dict, acc: dict) -> None:
     """
     Flatten a nested single policy into a list of single policies.
+    Nested policies are walked iteratively, in their definition order.
 
     :param single_policy_name (str): Name of the single policy to be flattened
     :param single_policy (dict): Single policy to be flattened
     :param acc (dict): Accumulator dictionary
     """
-    if "protocols" in single_policy:
-        # Policy is not nested
-        acc[single_policy_name] = single_policy
-    else:
-        # Policy is nested
-        for subpolicy in single_policy:
-            flatten_policies(subpolicy, single_policy[subpolicy], acc)
+    stack = [(single_policy_name, single_policy)]
+    while stack:
+        single_policy_name, single_policy = stack.pop()
+        if "protocols" in single_policy:
+            # Policy is not nested
+            acc[single_policy_name] = single_policy
+        else:
+            # Policy is nested,
+            # push subpolicies in reverse order to pop them in definition order
+            stack.extend(reversed(single_policy.items()))
 
 
 def flatten_interaction(interaction: dict) -> dict:
@@ -214,6 +283,51 @@ def is_bidirectional(policy: dict) -> bool:
     return policy.get("bidirectional", False)
 
 
+class PolicyFlags(NamedTuple):
+    """
+    Type flags of a policy, computed once per policy.
+    """
+    one_off: bool
+    transient: bool
+    periodic: bool
+    bidirectional: bool
+
+
+def get_policy_flags(policy: dict) -> PolicyFlags:
+    """
+    Compute the type flags of the given policy.
+
+    :param policy: Policy to compute the flags of.
+    :return: Flags of the policy.
+    """
+    return PolicyFlags(
+        one_off       = is_one_off(policy),
+        transient     = is_transient(policy),
+        periodic      = is_periodic(policy),
+        bidirectional = bool(is_bidirectional(policy))
+    )
+
+
+def encode_dns_qtypes(policy: dict) -> None:
+    """
+    Translate the (m)DNS query types matched by the given policy, if any,
+    into a set of integer type codes, in place.
+    Unknown type names are left out, as no edited value can match them.
+
+    :param policy: Policy to translate the query types of.
+    """
+    for protocol in ("dns", "mdns"):
+        protocol_fields = policy.get("protocols", {}).get(protocol, None)
+        if not isinstance(protocol_fields, dict):
+            continue
+        qtype = protocol_fields.get("qtype", None)
+        if qtype is None or isinstance(qtype, frozenset):
+            # No query type, or already translated (policy shared through a YAML alias)
+            continue
+        qtypes = qtype if isinstance(qtype, list) else [qtype]
+        protocol_fields["qtype"] = frozenset(DNS_RR_TYPE_CODES[t] for t in qtypes if t in DNS_RR_TYPE_CODES)
+
+
 def is_backwards(policy_name: str) -> bool:
     """
     Check if the given policy is backwards.
@@ -236,47 +350,46 @@ def expected_verdict_drop(row: dict, reason: str, interaction_name: str = None)
     row["expected_verdict"] = DROP
     row["reason"] = reason
     if reason == "EDITED":
-        logging.info(f"Packet #{row['id']} was edited. Expected verdict is DROP.")
+        logging.info("Packet #%s was edited. Expected verdict is DROP.", row["id"])
     elif reason == "INTERACTION":
-        logging.info(f"Previous step in interaction {interaction_name} " +
-                     f"for packet #{row['id']}. " +
-                      "was not found with ACCEPT verdict. " +
-                     f"Expected verdict is DROP.")
+        logging.info("Previous step in interaction %s "
+                     "for packet #%s. "
+                     "was not found with ACCEPT verdict. "
+                     "Expected verdict is DROP.",
+                     interaction_name, row["id"])
         
 
-def is_compliant(packet: dict, edit: dict, profile: dict) -> bool:
+def is_compliant(packet: dict, edit: tuple, policies: dict) -> bool:
     """
     Check if the given edited packet is still compliant with the given profile.
     For now, only check (m)DNS packets, on the qtype field.
     TODO: extend for all protocols.
 
     :param packet: Packet to check.
-    :param edit: Edit applied to the packet.
-    :param profile: Profile to check against.
+    :param edit: Edit applied to the packet, as a tuple (protocol, field, new value).
+    :param policies: Flattened profile policies to check against, per interaction
+                     (single policies being under the `single` interaction).
     :return: True if the packet is compliant, False otherwise.
     """
+    edit_protocol, edit_field, edit_new_value = edit
     # Do not consider non-(m)DNS packets
-    if edit["protocol"] != "DNS" and edit["protocol"] != "mDNS":
+    if edit_protocol != "DNS" and edit_protocol != "mDNS":
         return False
     # Packet is mDNS, and edited field is qr flag -> always compliant
-    if edit["protocol"] == "mDNS" and edit["field"] == "qr":
+    if edit_protocol == "mDNS" and edit_field == "qr":
         return True
     # Do not consider (m)DNS packets for which the edited field is not qtype
-    if edit["field"] != "qtype":
+    if edit_field != "qtype":
         return False
 
     # Packet is (m)DNS and edited field is qtype
     # Check if the new qtype is compliant for the given policy
-    protocol = edit["protocol"].lower()
+    protocol = edit_protocol.lower()
     interaction_name, policy_name = packet["policy"].split("#")
     if policy_name.endswith("-backward"):
         # Strip "-backward" suffix
         policy_name = policy_name.replace("-backward", "")
-    policy = {}
-    if interaction_name == "single":
-        policy = deep_get(profile, policy_name, "single-policies")
-    else:
-        policy = deep_get(profile, policy_name, "interactions")
+    policy = policies[interaction_name][policy_name]
 
     # Error checking
     if protocol not in policy["protocols"]:
@@ -287,14 +400,335 @@ def is_compliant(packet: dict, edit: dict, profile: dict) -> bool:
         # Packet is not matched on DNS qtype
         return False
     
-    # Packet is matched on DNS qtype
-    new_qtype = DNS_RR_TYPES.get(int(edit["new_value"]), 0)
-    if isinstance(dns_valid_types, list):
-        # List of valid qtypes
-        return new_qtype in dns_valid_types
-    else:
-        # Only one valid qtype
-        return new_qtype == dns_valid_types
+    # Packet is matched on DNS qtype,
+    # valid qtypes were translated to a set of integer codes at profile load
+    return int(edit_new_value) in dns_valid_types
+
+
+@dataclass(slots=True)
+class DeviceProfile:
+    """
+    Device profile, along with the tables precomputed from it once per device.
+    """
+    policies: dict                  # Flattened policies, per interaction (and `single`), with (m)DNS qtypes translated to integer codes
+    interaction_policy_names: dict  # Ordered policy names, per interaction
+    interaction_policy_idx: dict    # Policy positions, per interaction and policy
+    interaction_policy_flags: dict  # Policy type flags, per interaction and policy
+    single_policy_flags: dict       # Policy type flags, per single policy
+
+
+def load_device_profile(device_profile_file: str) -> DeviceProfile:
+    """
+    Load a device YAML profile, and precompute the tables used to process its log files.
+
+    :param device_profile_file: Path to the device YAML profile.
+    :return: Device profile, with its precomputed tables.
+    """
+    profile = {}
+    with open(device_profile_file, "r") as f:
+        profile = yaml.load(f, IncludeLoader)
+    # Sections may be absent or empty
+    interactions = profile.get("interactions") or {}
+    single_policies = profile.get("single-policies") or {}
+
+    # Flatten the profile interactions once,
+    # and index the position and type flags of their policies
+    policies = {}
+    interaction_policy_names = {}
+    interaction_policy_idx = {}
+    interaction_policy_flags = {}
+    for interaction_name, interaction in interactions.items():
+        interaction = flatten_interaction(interaction)
+        for policy in interaction.values():
+            encode_dns_qtypes(policy)
+        policies[interaction_name] = interaction
+        interaction_policy_names[interaction_name] = list(interaction.keys())
+        interaction_policy_idx[interaction_name] = {policy_name: idx for idx, policy_name in enumerate(interaction)}
+        interaction_policy_flags[interaction_name] = {policy_name: get_policy_flags(policy) for policy_name, policy in interaction.items()}
+    # Type flags of single policies
+    policies["single"] = flatten_interaction(single_policies)
+    for policy in policies["single"].values():
+        encode_dns_qtypes(policy)
+    single_policy_flags = {policy_name: get_policy_flags(policy) for policy_name, policy in single_policies.items()}
+
+    return DeviceProfile(
+        policies                 = policies,
+        interaction_policy_names = interaction_policy_names,
+        interaction_policy_idx   = interaction_policy_idx,
+        interaction_policy_flags = interaction_policy_flags,
+        single_policy_flags      = single_policy_flags
+    )
+
+
+def process_log_file(device_profile: DeviceProfile, log_file_name: str, ground_truth_file_name: str, edit_log_file_name: str, final_log_file_name: str) -> None:
+    """
+    Link the packet verdicts of a log file with the device interactions,
+    and write the expected verdict of each packet to the final log file.
+
+    :param device_profile: Device profile, with its precomputed tables.
+    :param log_file_name: Merged log file to process.
+    :param ground_truth_file_name: Merged ground truth log file of the same scenario.
+    :param edit_log_file_name: Log of the edits applied to the scenario PCAP.
+    :param final_log_file_name: Final log file to write.
+    """
+    logging.info("Processing log file %s", log_file_name)
+
+    # Precomputed profile tables
+    policies = device_profile.policies
+    interaction_policy_names = device_profile.interaction_policy_names
+    interaction_policy_idx = device_profile.interaction_policy_idx
+    interaction_policy_flags = device_profile.interaction_policy_flags
+    single_policy_flags = device_profile.single_policy_flags
+    default_policy_flags = get_policy_flags({})
+
+    # Open files
+    log_file = open(log_file_name, "r")
+    log_reader = csv.DictReader(log_file)
+    final_log_file = open(final_log_file_name, "w", buffering=1 << 20)
+
+    # Collect the IDs of accepted ground truth packets, while streaming the file:
+    # a packet is accepted if any of its ground truth rows is
+    ground_truth_accept = set()
+    with open(ground_truth_file_name, "r") as ground_truth_file:
+        ground_truth_reader = csv.reader(ground_truth_file, delimiter=",")
+        header = next(ground_truth_reader)
+        id_idx, verdict_idx = header.index("id"), header.index("verdict")
+        for pkt in ground_truth_reader:
+            if pkt[verdict_idx] == ACCEPT:
+                ground_truth_accept.add(pkt[id_idx])
+    # Index edited packets by new hash, while streaming the file,
+    # keeping the first edit of each hash, and only the edit fields checked for compliance
+    edited_packets = {}
+    with open(edit_log_file_name, "r") as edit_log_file:
+        for packet in csv.DictReader(edit_log_file, delimiter=","):
+            if packet["new_hash"] != packet["old_hash"]:
+                # Edit protocol and field values are interned, as they are compared against constants
+                edited_packets.setdefault(packet["new_hash"], (sys.intern(packet["protocol"]), sys.intern(packet["field"]), packet["new_value"]))
+
+    # Write final log file header
+    fieldnames = log_reader.fieldnames.copy()
+    index = fieldnames.index("verdict")
+    fieldnames[index] = "actual_verdict"
+    fieldnames.insert(index, "expected_verdict")
+    fieldnames.append("reason")
+    final_log_file_writer = csv.writer(final_log_file)
+    final_log_file_writer.writerow(fieldnames)
+
+    # Process CSV file
+    rows = list(log_reader)
+    # Parse the policy of each row once
+    row_policies = [parse_policy(row["policy"]) for row in rows]
+    # Keep whether each row was accepted aside, as rows are updated in place
+    row_accepted = [row["verdict"] == ACCEPT for row in rows]
+
+    # Index rows per interaction, and single policy rows per policy,
+    # to only walk back through the rows of the current interaction
+    interaction_rows = {}
+    single_policy_rows = {}
+    for i in range(len(rows)):
+        if row_policies[i] is None:
+            continue
+        row_interaction_name, row_policy_name = row_policies[i]
+        interaction_rows.setdefault(row_interaction_name, []).append(i)
+        if row_interaction_name == "single":
+            single_policy_rows.setdefault(row_policy_name, []).append(i)
+    # Row index lists in the same interaction, per policy, filled lazily
+    policy_interaction_rows = {}
+
+    for i in range(len(rows)):
+        row = rows[i]
+        logging.debug("Processing packet %s of file %s", row, log_file_name)
+        row["actual_verdict"] = row.pop("verdict")
+        ground_truth_verdict = ACCEPT if row["id"] in ground_truth_accept else DROP
+
+        # Check if packet was edited
+        edited_packet = edited_packets.get(row["hash"], None)
+        if edited_packet is not None and not is_compliant(row, edited_packet, policies):
+            # Packet was edited and is not compliant
+            # Expected verdict is DROP
+            expected_verdict_drop(row, "EDITED")
+            continue
+
+        # Packet was not edited
+        # Must check if packet is part of an interaction containing previously edited packets
+        
+        # Get packet interaction and policy
+        if row_policies[i] is None:
+            # No policy name, packet was dropped by NFTables
+            # Expected verdict is equal to ground truth
+            row["expected_verdict"] = ground_truth_verdict
+            row["reason"] = "GROUND_TRUTH"
+            logging.info("Packet #%s dropped by NFTables. "
+                         "Expected verdict is %s.",
+                         row["id"], ground_truth_verdict)
+            continue
+
+        # Interaction and policy were successfully retrieved
+        interaction_name, policy_name = row_policies[i]
+        fwd_policy_name = policy_name.replace("-backward", "")
+        logging.info("Packet #%s for policy %s not edited. "
+                     "Checking interaction %s for edited packets.",
+                     row["id"], policy_name, interaction_name)
+        
+        is_first = False  # Whether packet is first in interaction
+        expected_previous_policy_names = []
+
+        if interaction_name == "single":
+            # Individual policy
+            policy_flags = single_policy_flags.get(fwd_policy_name, default_policy_flags)
+            if policy_flags.one_off and policy_flags.bidirectional:
+                if is_backwards(policy_name):
+                    # One-off bidirectional backward policy,
+                    # search for preceding forward packet
+                    is_first = False
+                    expected_previous_policy_names.append(fwd_policy_name)
+                else:
+                    # One-off bidirectional forward policy,
+                    # search for preceding backward packet
+                    is_first = True
+                    expected_previous_policy_names.append(f"{fwd_policy_name}-backward")
+            else:
+                # Unedited individual policy,
+                # either unidirectional one-off,
+                # or transient / periodic.
+                # Expected verdict is equal to ground truth
+                row["expected_verdict"] = row["actual_verdict"]
+                row["reason"] = "GROUND_TRUTH"
+                logging.info("Packet #%s not edited "
+                             "and from individual policy %s. "
+                             "Expected verdict is %s.",
+                             row["id"], fwd_policy_name, row["actual_verdict"])
+                continue
+        
+        else:
+            # Policy part of an interaction
+            policy_names = interaction_policy_names[interaction_name]
+            policy_idx = interaction_policy_idx[interaction_name][fwd_policy_name]
+            interaction_flags = interaction_policy_flags[interaction_name]
+            policy_flags = interaction_flags[fwd_policy_name]
+            is_first = policy_idx == 0  # Whether policy is first in interaction
+
+            # Get expected previous policy
+            if (policy_flags.one_off or policy_flags.transient) and policy_flags.bidirectional and is_backwards(policy_name):
+                # Current policy is the backward of a one-off or transient policy
+                expected_previous_policy_names.append(fwd_policy_name)
+
+            else:
+                # Current policy can be:
+                # - the forward of a one-off policy
+                # - a transient policy
+                # - a periodic policy
+
+                # Expected previous policy is the previous step in the interaction
+                # (last step if the current policy is the first in the interaction)
+                backtrack_idx = policy_idx - 1
+                while True:
+                    expected_previous_policy_name = policy_names[backtrack_idx]
+                    previous_flags = interaction_flags[expected_previous_policy_name]
+                    if previous_flags.one_off and previous_flags.bidirectional:
+                        # If previous policy is one-off and bidirectional,
+                        # expected previous policy is the backward one
+                        expected_previous_policy_name += "-backward"
+                    expected_previous_policy_names.append(expected_previous_policy_name)
+
+                    if ( previous_flags.transient or previous_flags.periodic ) and previous_flags.bidirectional:
+                        # If previous policy is transient or periodic, and bidirectional,
+                        # add backward policy to expected previous policies
+                        expected_previous_policy_names.append(f"{expected_previous_policy_name}-backward")
+                
+                    if previous_flags.periodic:
+                        # If previous policy is periodic,
+                        # add second previous policy to expected previous policies
+                        backtrack_idx -= 1
+                    else:
+                        break
+
+                
+        # Loop backwards starting from current row, in the same interaction.
+        # Loop invariants are hoisted, as this is the innermost loop.
+        expected_previous_policy_names = set(expected_previous_policy_names)
+        is_expected_policy = policy_name in expected_previous_policy_names
+        one_off = policy_flags.one_off
+        seen_previous_policy = False
+        indices_lists = policy_interaction_rows.get(row_policies[i], None)
+        if indices_lists is None:
+            indices_lists = same_interaction_rows(interaction_name, policy_name, interaction_rows, single_policy_rows)
+            policy_interaction_rows[row_policies[i]] = indices_lists
+        for j in previous_rows_in_interaction(i, indices_lists):
+            actual_previous_policy_name = row_policies[j][1]
+            is_previous_accepted = row_accepted[j]
+
+            if ( (actual_previous_policy_name == policy_name) or
+                    (not one_off and is_same_policy(fwd_policy_name, actual_previous_policy_name)) ):
+                # Previous policy is equal to current policy
+                if not one_off and is_previous_accepted:
+                    # Encountered same policy with ACCEPT verdict
+                    # Expected verdict is equal to actual verdict
+                    row["expected_verdict"] = row["actual_verdict"]
+                    row["reason"] = "GROUND_TRUTH"
+                    logging.info("Packet %s: "
+                                 "same policy %s encountered with ACCEPT verdict. "
+                                 "Expected verdict is %s.",
+                                 row["id"], policy_name, row["actual_verdict"])
+                    break
+
+                if seen_previous_policy and one_off and is_previous_accepted and not is_expected_policy:
+                    # Current policy should not be this one
+                    # Expected verdict is DROP
+                    expected_verdict_drop(row, "INTERACTION", interaction_name)
+                    break
+                # Otherwise, continue iterating backwards to find the previous step
+
+            elif actual_previous_policy_name in expected_previous_policy_names:
+                seen_previous_policy = True
+                if is_previous_accepted:
+                    # Previous step is present and ACCEPTed
+                    # Expected verdict is ACCEPT
+                    row["expected_verdict"] = row["actual_verdict"]
+                    row["reason"] = "GROUND_TRUTH"
+                    logging.info("Previous step in interaction %s "
+                                 "for packet #%s. "
+                                 "has been found with ACCEPT verdict. "
+                                 "Expected verdict is %s.",
+                                 interaction_name, row["id"], row["actual_verdict"])
+                    break
+                # Previous step is present but with DROP verdict
+                # Continue iterating backwards, hoping to find an ACCEPTed one
+
+            elif is_previous_accepted:
+                # Too old previous step with ACCEPT verdict
+                # Did not find ACCEPTed previous step
+                # Expected verdict is DROP
+                expected_verdict_drop(row, "INTERACTION", interaction_name)
+                break
+
+            # Nothing relevant found, continue iterating backwards
+
+        else:
+            # Went back to the beginning of the log file,
+            # without finding ACCEPTed previous step.
+            if is_first:
+                # Current policy is the first in its interaction
+                # Expected verdict is ACCEPT
+                row["expected_verdict"] = row["actual_verdict"]
+                row["reason"] = "GROUND_TRUTH"
+                logging.info("Packet #%s not edited "
+                             "and from policy %s. "
+                             "Expected verdict is %s.",
+                             row["id"], row["policy"], row["actual_verdict"])
+            else:
+                # Current policy is not the first in its interaction
+                # Expected verdict is DROP
+                expected_verdict_drop(row, "INTERACTION", interaction_name)
+
+    # Write all annotated rows to the final log file at once,
+    # as tuples of values in the final log file column order
+    final_log_file_writer.writerows(map(operator.itemgetter(*fieldnames), rows))
+    logging.info("Wrote final log file %s", final_log_file_name)
+
+    # Close files
+    log_file.close()
+    final_log_file.close()
 
 
 # Program entry point
@@ -311,13 +745,13 @@ if __name__ == "__main__":
 
     ### LOGGING CONFIGURATION ###
     logging.basicConfig(level=logging.INFO)
-    logging.info(f"Starting {script_name}")
+    logging.info("Starting %s", script_name)
 
     ### READ DATA ###
     device_pcaps = {}
     device_pcaps_file = os.path.join(parent_dir, "device-pcaps.json")
-    with open(device_pcaps_file, "r") as f:
-        device_pcaps = json.load(f)
+    with open(device_pcaps_file, "rb") as f:
+        device_pcaps = json_loads(f.read())
     logging.info("Read PCAP database.")
 
 
@@ -329,10 +763,10 @@ if __name__ == "__main__":
 
         # Check if device directory exists
         if not os.path.isdir(device_logs_dir):
-            logging.warning(f"Device directory {device_logs_dir} does not exist. Skipping.")
+            logging.warning("Device directory %s does not exist. Skipping.", device_logs_dir)
             continue
 
-        device_ground_truth_dir = os.path.join(ground_truth_dir, device)
+        device_ground_truth_dir = os.path.join(ground_truth_dir, device, "merged")
         device_dir = os.path.join(devices_dir, device)
         device_traces_dir = os.path.join(device_dir, "traces")
         device_edited_log_dir = os.path.join(device_traces_dir, "edited", "csv")
@@ -340,260 +774,29 @@ if __name__ == "__main__":
         os.makedirs(device_final_dir, exist_ok=True)
 
         # Device YAML profile
-        device_profile_file = os.path.join(device_dir, "profile.yaml")
-        profile = {}
-        with open(device_profile_file, "r") as f:
-            profile = yaml.load(f, IncludeLoader)
-
-        # Loop on CSV log files
-        log_files = sorted(os.listdir(device_logs_dir))
+        device_profile = load_device_profile(os.path.join(device_dir, "profile.yaml"))
+
+        # List CSV log files, in name order
+        with os.scandir(device_logs_dir) as entries:
+            log_files = sorted(entry.name for entry in entries if entry.is_file() and entry.name.endswith(".csv"))
+        log_file_names = []
+        ground_truth_file_names = []
+        edit_log_file_names = []
+        final_log_file_names = []
         for log_file_name in log_files:
             scenario = log_file_name.split(".")[0]
-            log_file_name = os.path.join(device_logs_dir, log_file_name)
-            logging.info(f"Processing log file {log_file_name}")
-            ground_truth_file_name = os.path.join(device_ground_truth_dir, "merged", f"{scenario}.merged.csv")
-            edit_log_file_name = os.path.basename(log_file_name.replace(".merged", ""))
-            edit_log_file_name = os.path.join(device_edited_log_dir, edit_log_file_name)
-            final_log_file_name = os.path.basename(log_file_name.replace(".merged", ".final"))
-            final_log_file_name = os.path.join(device_final_dir, final_log_file_name)
-
-            # Open files
-            log_file = open(log_file_name, "r")
-            log_reader = csv.DictReader(log_file)
-            ground_truth_file = open(ground_truth_file_name, "r")
-            ground_truth_list = list(csv.DictReader(ground_truth_file, delimiter=","))
-            edit_log_file = open(edit_log_file_name, "r")
-            edit_log_list = list(csv.DictReader(edit_log_file, delimiter=","))
-            final_log_file = open(final_log_file_name, "w")
-
-            # Write final log file header
-            fieldnames = log_reader.fieldnames.copy()
-            index = fieldnames.index("verdict")
-            fieldnames[index] = "actual_verdict"
-            fieldnames.insert(index, "expected_verdict")
-            fieldnames.append("reason")
-            final_log_file_writer = csv.DictWriter(final_log_file, fieldnames=fieldnames)
-            final_log_file_writer.writeheader()
-
-            # Process CSV file
-            rows = list(log_reader)
-            for i in range(len(rows)):
-                row = rows[i].copy()
-                logging.info(f"Processing packet {row} of file {log_file_name}")
-                row["actual_verdict"] = row.pop("verdict")
-                ground_truth_rows = [pkt for pkt in ground_truth_list if pkt["id"] == row["id"]]
-                any_accept = any(pkt["verdict"] == ACCEPT for pkt in ground_truth_rows)
-                ground_truth_verdict = ACCEPT if any_accept else DROP
-
-                # Check if packet was edited
-                try:
-                    edited_packet = next(packet for packet in edit_log_list if packet["new_hash"] == row["hash"] and packet["new_hash"] != packet["old_hash"])
-                except StopIteration:
-                    # Packet was not edited
-                    pass
-                else:
-                    if not is_compliant(row, edited_packet, profile):
-                        # Packet was edited and is not compliant
-                        # Expected verdict is DROP
-                        expected_verdict_drop(row, "EDITED")
-                        final_log_file_writer.writerow(row)
-                        logging.info(f"Final log file {final_log_file_name}: wrote {row}")
-                        continue
-
-                # Packet was not edited
-                # Must check if packet is part of an interaction containing previously edited packets
-                
-                # Get packet interaction and policy
-                try:
-                    interaction_name, policy_name = row["policy"].split("#")
-                except ValueError:
-                    # No policy name, packet was dropped by NFTables
-                    # Expected verdict is equal to ground truth
-                    row["expected_verdict"] = ground_truth_verdict
-                    row["reason"] = "GROUND_TRUTH"
-                    logging.info(f"Packet #{row['id']} dropped by NFTables. " +
-                                    f"Expected verdict is {ground_truth_verdict}.")
-                    final_log_file_writer.writerow(row)
-                    logging.info(f"Final log file {final_log_file_name}: wrote {row}")
-                    continue
-
-                # Interaction and policy were successfully retrieved
-                fwd_policy_name = policy_name.replace("-backward", "")
-                logging.info(f"Packet #{row['id']} for policy {policy_name} not edited. " +
-                            f"Checking interaction {interaction_name} for edited packets.")
-                
-                policy = {}
-                is_first = False  # Whether packet is first in interaction
-                expected_previous_policy_names = []
-
-                if interaction_name == "single":
-                    # Individual policy
-                    policy = profile.get("single-policies", {}).get(fwd_policy_name, {})
-                    if is_one_off(policy) and is_bidirectional(policy):
-                        if is_backwards(policy_name):
-                            # One-off bidirectional backward policy,
-                            # search for preceding forward packet
-                            is_first = False
-                            expected_previous_policy_names.append(fwd_policy_name)
-                        else:
-                            # One-off bidirectional forward policy,
-                            # search for preceding backward packet
-                            is_first = True
-                            expected_previous_policy_names.append(f"{fwd_policy_name}-backward")
-                    else:
-                        # Unedited individual policy,
-                        # either unidirectional one-off,
-                        # or transient / periodic.
-                        # Expected verdict is equal to ground truth
-                        row["expected_verdict"] = row["actual_verdict"]
-                        row["reason"] = "GROUND_TRUTH"
-                        logging.info(f"Packet #{row['id']} not edited " +
-                                        f"and from individual policy {fwd_policy_name}. " +
-                                        f"Expected verdict is {row['actual_verdict']}.")
-                        final_log_file_writer.writerow(row)
-                        logging.info(f"Final log file {final_log_file_name}: wrote {row}")
-                        continue
-                
-                else:
-                    # Policy part of an interaction
-                    interaction = flatten_interaction(profile.get("interactions", {}).get(interaction_name, {}))
-                    policy_names = list(interaction.keys())
-                    policy_idx = policy_names.index(fwd_policy_name)
-                    policy = interaction[fwd_policy_name]
-                    is_first = policy_idx == 0  # Whether policy is first in interaction
-
-                    # Get expected previous policy
-                    if (is_one_off(policy) or is_transient(policy)) and is_bidirectional(policy) and is_backwards(policy_name):
-                        # Current policy is the backward of a one-off or transient policy
-                        expected_previous_policy_names.append(policy_name.replace("-backward", ""))
-
-                    else:
-                        # Current policy can be:
-                        # - the forward of a one-off policy
-                        # - a transient policy
-                        # - a periodic policy
-
-                        # Expected previous policy is the previous step in the interaction
-                        # (last step if the current policy is the first in the interaction)
-                        backtrack_idx = policy_idx - 1
-                        while True:
-                            expected_previous_policy_name = policy_names[backtrack_idx]
-                            expected_previous_policy = interaction[expected_previous_policy_name]
-                            if is_one_off(expected_previous_policy) and is_bidirectional(expected_previous_policy):
-                                # If previous policy is one-off and bidirectional,
-                                # expected previous policy is the backward one
-                                expected_previous_policy_name += "-backward"
-                            expected_previous_policy_names.append(expected_previous_policy_name)
-
-                            if ( is_transient(expected_previous_policy) or is_periodic(expected_previous_policy) ) and is_bidirectional(expected_previous_policy):
-                                # If previous policy is transient or periodic, and bidirectional,
-                                # add backward policy to expected previous policies
-                                expected_previous_policy_names.append(f"{expected_previous_policy_name}-backward")
-                        
-                            if is_periodic(expected_previous_policy):
-                                # If previous policy is periodic,
-                                # add second previous policy to expected previous policies
-                                backtrack_idx -= 1
-                            else:
-                                break
-
-                        
-                # Loop backwards starting from current row, in the same interaction
-                j = i - 1
-                seen_previous_policy = False
-                while j >= 0:
-                    previous_row = rows[j]
-
-                    if is_default_drop(previous_row["policy"]):
-                        j -= 1
-                        continue
-
-                    if is_same_interaction(previous_row["policy"], row["policy"]):
-                        # Still in same interaction
-                        actual_previous_policy_name = previous_row["policy"].split("#")[1]
-                        actual_previous_policy_verdict = previous_row["verdict"]
-
-                        if ( (actual_previous_policy_name == policy_name) or
-                                (not is_one_off(policy) and is_same_policy(fwd_policy_name, actual_previous_policy_name)) ):
-                            # Previous policy is equal to current policy
-                            if not is_one_off(policy) and actual_previous_policy_verdict == ACCEPT:
-                                # Encountered same policy with ACCEPT verdict
-                                # Expected verdict is equal to actual verdict
-                                row["expected_verdict"] = row["actual_verdict"]
-                                row["reason"] = "GROUND_TRUTH"
-                                logging.info(f"Packet {row['id']}: " +
-                                                f"same policy {policy_name} encountered with ACCEPT verdict. " +
-                                                f"Expected verdict is {row['actual_verdict']}.")
-                                break
-
-                            if seen_previous_policy and is_one_off(policy) and actual_previous_policy_verdict == ACCEPT and policy_name not in expected_previous_policy_names:
-                                # Current policy should not be this one
-                                # Expected verdict is DROP
-                                expected_verdict_drop(row, "INTERACTION", interaction_name)
-                                break
-                            else:
-                                # continue iterating backwards to find the previous step
-                                j -= 1
-                                continue
-
-                        elif actual_previous_policy_name in expected_previous_policy_names:
-                            seen_previous_policy = True
-                            if actual_previous_policy_verdict == "ACCEPT":
-                                # Previous step is present and ACCEPTed
-                                # Expected verdict is ACCEPT
-                                row["expected_verdict"] = row["actual_verdict"]
-                                row["reason"] = "GROUND_TRUTH"
-                                logging.info(f"Previous step in interaction {interaction_name} " +
-                                                f"for packet #{row['id']}. " +
-                                                "has been found with ACCEPT verdict. " +
-                                                f"Expected verdict is {row['actual_verdict']}.")
-                                break
-                            else:
-                                # Previous step is present but with DROP verdict
-                                # Continue iterating backwards, hoping to find an ACCEPTed one
-                                j -= 1
-                                continue
-
-                        elif actual_previous_policy_name not in expected_previous_policy_names and actual_previous_policy_verdict == ACCEPT:
-                            # Too old previous step with ACCEPT verdict
-                            # Did not find ACCEPTed previous step
-                            # Expected verdict is DROP
-                            expected_verdict_drop(row, "INTERACTION", interaction_name)
-                            break
-
-                        else:
-                            # Nothing relevant found, continue iterating backwards
-                            j -= 1
-                            continue
-
-                    else:
-                        # Encountered other interaction
-                        # Might be a parasite packet
-                        # Continue iterating backwards, hoping to find the interaction previous step
-                        j -= 1
-                        continue
-
-                if j < 0:
-                    # Went back to the beginning of the log file,
-                    # without finding ACCEPTed previous step.
-                    if is_first:
-                        # Current policy is the first in its interaction
-                        # Expected verdict is ACCEPT
-                        row["expected_verdict"] = row["actual_verdict"]
-                        row["reason"] = "GROUND_TRUTH"
-                        logging.info(f"Packet #{row['id']} not edited " +
-                                        f"and from policy {row['policy']}. " +
-                                        f"Expected verdict is {row['actual_verdict']}.")
-                    else:
-                        # Current policy is not the first in its interaction
-                        # Expected verdict is DROP
-                        expected_verdict_drop(row, "INTERACTION", interaction_name)
-
-                final_log_file_writer.writerow(row)
-                logging.info(f"Final log file {final_log_file_name}: wrote {row}")
-
-            # Close files
-            log_file.close()
-            ground_truth_file.close()
-            edit_log_file.close()
-            final_log_file.close()
+            log_file_names.append(os.path.join(device_logs_dir, log_file_name))
+            ground_truth_file_names.append(os.path.join(device_ground_truth_dir, f"{scenario}.merged.csv"))
+            edit_log_file_names.append(os.path.join(device_edited_log_dir, log_file_name.replace(".merged", "")))
+            final_log_file_names.append(os.path.join(device_final_dir, log_file_name.replace(".merged", ".final")))
+
+        # Process log files in parallel, as they are independent given the device profile
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            list(executor.map(
+                process_log_file,
+                repeat(device_profile),
+                log_file_names,
+                ground_truth_file_names,
+                edit_log_file_names,
+                final_log_file_names
+            ))
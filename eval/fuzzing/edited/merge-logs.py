@@ -9,8 +9,11 @@ from pathlib import Path
 import json
 import csv
 import re
+import bisect
+import operator
 import logging
-from typing import Union, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
 
 
 # Verdict values
@@ -18,14 +21,46 @@ ACCEPT = "ACCEPT"
 DROP = "DROP"
 QUEUE = "QUEUE"
 
+# Edit suffix in an edited log file name
+EDIT_PATTERN = re.compile(r"\.edit-\d+")
 
-def get_all_packets(rows: list, hash: str, timestamp: Union[float, str], start_idx: int = 0) -> Tuple[list, int]:
+
+def parse_timestamp(timestamp: str) -> int:
+    """
+    Parse a decimal timestamp, in seconds, to an integer number of nanoseconds.
+    Contrary to floats, timestamps are then compared exactly.
+
+    :param timestamp: decimal timestamp, in seconds
+    :return: timestamp, in nanoseconds
+    """
+    seconds, _, fraction = timestamp.partition(".")
+    return int(seconds) * 1_000_000_000 + int(fraction[:9].ljust(9, "0"))
+
+
+def index_packets(rows: list, timestamps: list, hash_idx: int) -> dict:
     """
-    Retrieve all packets from a list which have the given hash value and timestamp,
-    and represent the same packet matched with different policies.
-    As packet list is sorted, stop when packet timestamp is exceeded.
+    Index the rows of a packet list by hash value and timestamp.
 
     :param rows: list of rows
+    :param timestamps: timestamps of the rows, in nanoseconds
+    :param hash_idx: index of the hash value column
+    :return: dict mapping each (hash value, timestamp) pair to the sorted indices of its rows
+    """
+    index = {}
+    for i, row in enumerate(rows):
+        index.setdefault((row[hash_idx], timestamps[i]), []).append(i)
+    return index
+
+
+def get_indexed_packets(rows: list, index: dict, hash: str, timestamp: int, start_idx: int = 0) -> Tuple[list, int]:
+    """
+    Retrieve all packets from a sorted list which have the given hash value and timestamp,
+    starting from the given index, using the list index built by `index_packets`.
+    These represent the same packet matched with different policies,
+    or duplicate packets sent at the same time.
+
+    :param rows: sorted list of rows
+    :param index: index of the list, as returned by `index_packets`
     :param hash: packet hash value
     :param timestamp: packet timestamp
     :param start_idx: Optional; index to start from (default: 0)
@@ -33,64 +68,162 @@ def get_all_packets(rows: list, hash: str, timestamp: Union[float, str], start_i
         - list of rows with the given hash value
         - index following the last row with the given hash value
     """
-    timestamp = float(timestamp)
-    acc = []
-    result_idx = start_idx - 1
-    i = start_idx
-    for row in rows[i:]:
-        current_timestamp = float(row["timestamp"])
-        if current_timestamp > timestamp:
-            # As packet list is sorted, stop when timestamp is exceeded
-            if current_timestamp == 1678880460.621344:
-                print(acc, result_idx + 1)
-            break
-        
-        # Timestamp is not exceeded yet
-        if row["hash"] == hash and current_timestamp == timestamp:
-            acc.append(row)
-            result_idx = i
-        i += 1
-    return acc, result_idx + 1
-
-
-def get_ground_truth_policy(ground_truth_list: list, id: int) -> str:
+    indices = index.get((hash, timestamp), [])
+    first = bisect.bisect_left(indices, start_idx)
+    if first == len(indices):
+        # No packet found
+        return [], start_idx
+    return [rows[i] for i in indices[first:]], indices[-1] + 1
+
+
+def get_ground_truth_policy(ground_truth_policies: dict, id: str) -> str:
     """
-    Retrieve the ground truth policy from the ground truth list,
-    for the given packet ID.
+    Retrieve the ground truth policy for the given packet ID.
 
-    :param ground_truth_list: ground truth list
+    :param ground_truth_policies: ground truth policies, indexed by packet ID
     :param id: packet ID
     :return: ground truth policy for this packet
     """
-    try:
-        ground_truth_row = next(row for row in ground_truth_list if row["id"] == id)
-    except StopIteration:
+    ground_truth_policy = ground_truth_policies.get(id, None)
+    if ground_truth_policy is None:
         # Corresponding ground truth row not found
         logging.warning(f"Ground truth row not found for NFLog row #{id}.")
-        return None
-    else:
-        # Corresponding ground truth row found
-        return ground_truth_row["policy"]
+    return ground_truth_policy
 
 
-def merge_rows(nflog_row: dict, nfq_row: dict, ground_truth_policy: str) -> dict:
+def merge_rows(nflog_row: list, nfq_row: list, ground_truth_policy: str, columns: dict) -> list:
     """
     Merge corresponding NFLog and NFQueue rows into a single row.
 
     :param nflog_row: NFLog row
-    :param nfq_row: NFQueue row
+    :param nfq_row: NFQueue row, with the same columns as NFLog rows
     :param ground_truth_policy: ground truth policy corresponding to this packet
+    :param columns: index of each column, by name
     :return: merged row
     """
+    id_idx, policy_idx = columns["id"], columns["policy"]
     merged_row = nfq_row.copy()
-    merged_row["id"] = nflog_row["id"]
-    if merged_row["verdict"] == DROP and ground_truth_policy is not None:
-        merged_row["policy"] = ground_truth_policy
-    elif not merged_row["policy"]:
-        merged_row["policy"] = nflog_row["policy"]
+    merged_row[id_idx] = nflog_row[id_idx]
+    if merged_row[columns["verdict"]] == DROP and ground_truth_policy is not None:
+        merged_row[policy_idx] = ground_truth_policy
+    elif not merged_row[policy_idx]:
+        merged_row[policy_idx] = nflog_row[policy_idx]
     return merged_row
 
 
+def merge_log_file(nflog_file_name: str, nfq_file_name: str, ground_truth_file_name: str, merged_file_name: str) -> None:
+    """
+    Merge a NFLog CSV log file with its corresponding NFQueue CSV log file,
+    and write the result to the merged CSV log file.
+
+    :param nflog_file_name: NFLog CSV log file
+    :param nfq_file_name: corresponding NFQueue CSV log file
+    :param ground_truth_file_name: corresponding ground truth CSV log file
+    :param merged_file_name: merged CSV log file to write
+    """
+    # Read input files, closing each one as soon as it is read.
+    # NFLog and NFQueue rows must be held in memory to be sorted,
+    # while ground truth rows are streamed into their index.
+    # Rows are read as lists, and their columns are accessed by index.
+    # Blank lines are skipped.
+    logging.info(f"Read NFLog CSV file {nflog_file_name}")
+    with open(nflog_file_name, "r", buffering=1 << 20, newline="") as nflog_file:
+        nflog_reader = csv.reader(nflog_file)
+        fieldnames = next(nflog_reader)
+        nflog_list = [row for row in nflog_reader if row]
+    columns = {name: idx for idx, name in enumerate(fieldnames)}
+    id_idx, hash_idx, timestamp_idx, policy_idx, verdict_idx = (columns[name] for name in ("id", "hash", "timestamp", "policy", "verdict"))
+    nflog_list.sort(key=operator.itemgetter(timestamp_idx))
+    logging.info(f"Read NFQueue CSV file {nfq_file_name}")
+    with open(nfq_file_name, "r", buffering=1 << 20, newline="") as nfq_file:
+        nfq_reader = csv.reader(nfq_file)
+        nfq_fieldnames = next(nfq_reader)
+        # Lay NFQueue rows out with the NFLog columns,
+        # leaving the columns NFQueue does not log (i.e. the packet ID) empty
+        nfq_columns = [nfq_fieldnames.index(name) if name in nfq_fieldnames else None for name in fieldnames]
+        nfq_list = [[row[idx] if idx is not None else "" for idx in nfq_columns] for row in nfq_reader if row]
+    # Parse timestamps once per row,
+    # and sort NFQueue rows on their parsed timestamps
+    nflog_timestamps = [parse_timestamp(row[timestamp_idx]) for row in nflog_list]
+    nfq_timestamps = [parse_timestamp(row[timestamp_idx]) for row in nfq_list]
+    nfq_order = sorted(range(len(nfq_list)), key=nfq_timestamps.__getitem__)
+    nfq_list = [nfq_list[i] for i in nfq_order]
+    nfq_timestamps = [nfq_timestamps[i] for i in nfq_order]
+    nflog_index = index_packets(nflog_list, nflog_timestamps, hash_idx)
+    nfq_index = index_packets(nfq_list, nfq_timestamps, hash_idx)
+    logging.info(f"Read ground truth CSV file {ground_truth_file_name}")
+    # Index ground truth policies by packet ID, keeping the first row of each ID
+    ground_truth_policies = {}
+    with open(ground_truth_file_name, "r", buffering=1 << 20, newline="") as ground_truth_file:
+        ground_truth_reader = csv.reader(ground_truth_file)
+        ground_truth_fieldnames = next(ground_truth_reader)
+        ground_truth_id_idx = ground_truth_fieldnames.index("id")
+        ground_truth_policy_idx = ground_truth_fieldnames.index("policy")
+        for row in ground_truth_reader:
+            if row:
+                ground_truth_policies.setdefault(row[ground_truth_id_idx], row[ground_truth_policy_idx])
+
+    # Process NFLog file, collecting merged rows to write them at once
+    merged_rows = []
+    nflog_row_idx = 0
+    nfq_row_idx = 0
+    while nflog_row_idx < len(nflog_list):
+        nflog_row = nflog_list[nflog_row_idx]
+        verdict = nflog_row[verdict_idx]
+
+        # Rows which do not have the QUEUE verdict: write as is
+        if verdict != QUEUE:
+            # Get corresponding ground truth policy name
+            ground_truth_policy = get_ground_truth_policy(ground_truth_policies, nflog_row[id_idx])
+            merged_row = nflog_row.copy()
+            if verdict == DROP and ground_truth_policy is not None:
+                merged_row[policy_idx] = ground_truth_policy
+            merged_rows.append(merged_row)
+            logging.debug("Merged nflog row: %s.", merged_row)
+            nflog_row_idx += 1
+            continue
+
+        # Rows which have the QUEUE verdict: merge with corresponding NFQueue row.
+        # Duplicate packets are paired with NFQueue rows by position,
+        # and NFQueue rows are consumed in order,
+        # so this is not a plain join on hash value and timestamp.
+        hash = nflog_row[hash_idx]
+        timestamp = nflog_timestamps[nflog_row_idx]
+
+        # Get all NFLog rows with the same hash and timestamp
+        # (i.e. duplicate packets sent at the same time)
+        nflog_rows, nflog_row_idx = get_indexed_packets(nflog_list, nflog_index, hash, timestamp, nflog_row_idx)
+
+        # Get all corresponding NFQueue rows with the same hash and timestamp
+        nfq_rows, nfq_row_idx = get_indexed_packets(nfq_list, nfq_index, hash, timestamp, nfq_row_idx)
+
+        if len(nfq_rows) == 0:
+            logging.warning(f"NFQueue row not found for NFLog row with hash {hash} and timestamp {nflog_row[timestamp_idx]}")
+
+        elif len(nflog_rows) == len(nfq_rows):
+            # Each packet was matched with a single policy
+            for nflog_row, nfq_row in zip(nflog_rows, nfq_rows):
+                ground_truth_policy = get_ground_truth_policy(ground_truth_policies, nflog_row[id_idx])
+                merged_row = merge_rows(nflog_row, nfq_row, ground_truth_policy, columns)
+                merged_rows.append(merged_row)
+                logging.debug("Merged row: %s.", merged_row)
+
+        elif len(nflog_rows) == 1 and len(nfq_rows) > 1:
+            # One packet was matched with multiple policies
+            ground_truth_policy = get_ground_truth_policy(ground_truth_policies, nflog_row[id_idx])
+            for nfq_row in nfq_rows:
+                merged_row = merge_rows(nflog_row, nfq_row, ground_truth_policy, columns)
+                merged_rows.append(merged_row)
+                logging.debug("Merged row: %s.", merged_row)
+
+    # Write merged file
+    with open(merged_file_name, "w", buffering=1 << 20) as merged_file:
+        merged_writer = csv.writer(merged_file)
+        merged_writer.writerow(fieldnames)
+        merged_writer.writerows(merged_rows)
+    logging.info(f"Wrote merged CSV file {merged_file_name}.")
+
+
 # Program entry point
 if __name__ == "__main__":
 
@@ -137,95 +270,33 @@ if __name__ == "__main__":
             logging.warning(f"Logs directory for device {device} does not exist. Skipping.")
             continue
 
-        # Loop on CSV log files
+        # List CSV log files
         merged_logs_dir = os.path.join(device_logs_dir, "merged")
         os.makedirs(merged_logs_dir, exist_ok=True)
-        nflog_files = sorted(os.listdir(nflog_dir))
-        for nflog_file_name in nflog_files:
-            stem = Path(nflog_file_name).stem
-            nflog_file_name = os.path.join(nflog_dir, nflog_file_name)
+        nflog_file_names = []
+        nfq_file_names = []
+        ground_truth_file_names = []
+        merged_file_names = []
+        with os.scandir(nflog_dir) as entries:
+            nflog_entries = sorted((entry for entry in entries if entry.is_file()), key=lambda entry: entry.name)
+        for nflog_entry in nflog_entries:
+            stem = Path(nflog_entry.name).stem
+            nflog_file_names.append(nflog_entry.path)
             # Corresponding NFQueue log file
-            nfq_file_name = os.path.join(nfq_dir, f"{stem.replace('.log', '.nfq')}.csv")
+            nfq_file_names.append(os.path.join(nfq_dir, f"{stem.replace('.log', '.nfq')}.csv"))
             # Merged CSV log file
             merged_file_name = os.path.join(merged_logs_dir, f"{stem.replace('.log', '.merged')}.csv")
+            merged_file_names.append(merged_file_name)
             # Corresponding ground truth log file
-            pattern = r"\.edit-\d+"
-            ground_truth_stem = Path(merged_file_name).stem
-            ground_truth_stem = re.sub(pattern, "", ground_truth_stem)
-            ground_truth_file_name = os.path.join(ground_truth_dir, f"{ground_truth_stem}.csv")
-            
-            # Open files
-            logging.info(f"Open NFLog CSV file {nflog_file_name}")
-            nflog_file = open(nflog_file_name, "r")
-            logging.info(f"Open NFQueue CSV file {nfq_file_name}")
-            nfq_file = open(nfq_file_name, "r")
-            logging.info(f"Open ground truth CSV file {merged_file_name}")
-            ground_truth_file = open(ground_truth_file_name, "r")
-            logging.info(f"Open merged CSV file {merged_file_name}")
-            merged_file = open(merged_file_name, "w")
-
-            # Initialize CSV handlers
-            nflog_reader = csv.DictReader(nflog_file)
-            nfq_list = list(csv.DictReader(nfq_file))
-            nfq_list.sort(key=lambda row: float(row["timestamp"]))
-            ground_truth_list = list(csv.DictReader(ground_truth_file))
-            merged_writer = csv.DictWriter(merged_file, fieldnames=nflog_reader.fieldnames)
-            merged_writer.writeheader()
-
-            # Process NFLog file
-            nflog_list = list(nflog_reader)
-            nflog_list.sort(key=lambda row: row["timestamp"])
-            nflog_row_idx = 0
-            nfq_row_idx = 0
-            while nflog_row_idx < len(nflog_list):
-                nflog_row = nflog_list[nflog_row_idx]
-                verdict = nflog_row["verdict"]
-
-                # Rows which do not have the QUEUE verdict: write as is
-                if verdict != QUEUE:
-                    # Get corresponding ground truth policy name
-                    ground_truth_policy = get_ground_truth_policy(ground_truth_list, nflog_row["id"])
-                    merged_row = nflog_row.copy()
-                    if verdict == DROP and ground_truth_policy is not None:
-                        merged_row["policy"] = ground_truth_policy
-                    merged_writer.writerow(merged_row)
-                    logging.info(f"Wrote nflog row: {merged_row}.")
-                    nflog_row_idx += 1
-                    continue
-                
-                # Rows which have the QUEUE verdict: merge with corresponding NFQueue row
-                hash = nflog_row["hash"]
-                timestamp = float(nflog_row["timestamp"])
-
-                # Get all NFLog rows with the same hash and timestamp
-                # (i.e. duplicate packets sent at the same time)
-                nflog_rows, nflog_row_idx = get_all_packets(nflog_list, hash, timestamp, nflog_row_idx)
-                
-                # Get all corresponding NFQueue rows with the same hash and timestamp
-                nfq_rows, nfq_row_idx = get_all_packets(nfq_list, hash, timestamp, nfq_row_idx)
-
-                if len(nfq_rows) == 0:
-                    logging.warning(f"NFQueue row not found for NFLog row with hash {nflog_row['hash']} and timestamp {nflog_row['timestamp']}")
-
-                elif len(nflog_rows) == len(nfq_rows):
-                    # Each packet was matched with a single policy
-                    for nflog_row, nfq_row in zip(nflog_rows, nfq_rows):
-                        ground_truth_policy = get_ground_truth_policy(ground_truth_list, nflog_row["id"])
-                        merged_row = merge_rows(nflog_row, nfq_row, ground_truth_policy)
-                        merged_writer.writerow(merged_row)
-                        logging.info(f"Wrote merged row: {merged_row}.")
-
-                elif len(nflog_rows) == 1 and len(nfq_rows) > 1:
-                    # One packet was matched with multiple policies
-                    ground_truth_policy = get_ground_truth_policy(ground_truth_list, nflog_row["id"])
-                    for nfq_row in nfq_rows:
-                        merged_row = merge_rows(nflog_row, nfq_row, ground_truth_policy)
-                        merged_writer.writerow(merged_row)
-                        logging.info(f"Wrote merged row: {merged_row}.")
-
-            # Close files
-            nflog_file.close()
-            nfq_file.close()
-            ground_truth_file.close()
-            merged_file.close()
-            logging.info(f"Closed all CSV files.")
+            ground_truth_stem = EDIT_PATTERN.sub("", Path(merged_file_name).stem)
+            ground_truth_file_names.append(os.path.join(ground_truth_dir, f"{ground_truth_stem}.csv"))
+
+        # Merge log files in parallel, as they are independent
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            list(executor.map(
+                merge_log_file,
+                nflog_file_names,
+                nfq_file_names,
+                ground_truth_file_names,
+                merged_file_names
+            ))
@@ -3,15 +3,17 @@
 # Plot confusion matrix
 
 import os
+import importlib.util
 from pathlib import Path
 import json
-import csv
 import logging
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sn
-from sklearn.metrics import confusion_matrix, accuracy_score, precision_score, recall_score, f1_score
+from sklearn.metrics import confusion_matrix
 
 
 ### GLOBAL VARIABLES ###
@@ -19,6 +21,23 @@ script_name = os.path.basename(__file__)
 script_path = Path(os.path.abspath(__file__))
 script_dir = script_path.parents[0]
 parent_dir = script_path.parents[1]
+csv_engine = "pyarrow" if importlib.util.find_spec("pyarrow") is not None else "c"
+
+
+def read_final_log(csv_file: str) -> pd.DataFrame:
+    """
+    Read a final CSV log file, only parsing the needed columns.
+
+    :param csv_file: final CSV log file
+    :return: DataFrame containing the policy and verdicts of each packet
+    """
+    return pd.read_csv(
+        csv_file,
+        engine          = csv_engine,
+        usecols         = ["policy", "expected_verdict", "actual_verdict"],
+        dtype           = str,
+        keep_default_na = False
+    )
 
 
 def compute_metrics(device_pcaps: dict) -> dict:
@@ -31,16 +50,14 @@ def compute_metrics(device_pcaps: dict) -> dict:
     metrics = {}
 
     # Metrics for confusion matrix per packet
-    expected = []
-    actual = []
     labels = ["ACCEPT", "DROP"]
 
-    # Metrics for packet verdict per policy
-    per_policy = {}
-
     # Metrics for packet verdict per interaction
     per_interaction = {}
 
+    # All CSV log files
+    csv_files = []
+
     # Loop on devices
     for device in device_pcaps:
         device_logs_dir = os.path.join(script_dir, device, "final")
@@ -50,36 +67,33 @@ def compute_metrics(device_pcaps: dict) -> dict:
             logging.warning(f"Device directory {device_logs_dir} does not exist. Skipping.")
             continue
 
-        # Loop on CSV log files
-        csv_files = sorted(os.listdir(device_logs_dir))
-        for csv_file in csv_files:
-            csv_file = os.path.join(device_logs_dir, csv_file)
-            with open(csv_file, "r") as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-
-                    # Confusion matrix per packet
-                    expected.append(row["expected_verdict"])
-                    actual.append(row["actual_verdict"])
-
-                    # Packet verdict per policy
-                    policy = row["policy"]
-                    if policy not in per_policy:
-                        per_policy[policy] = {"expected": [], "actual": [], "labels": labels}
-                    per_policy[policy]["expected"].append(row["expected_verdict"])
-                    per_policy[policy]["actual"].append(row["actual_verdict"])
-
-                    """
-                    # Packet verdict per interaction
-                    interaction, policy = policy.split("#")
-                    if interaction != "single":
-                        if interaction not in per_interaction:
-                            per_interaction[interaction] = {"expected": [], "actual": [], "labels": labels}
-                        per_interaction[interaction]["expected"].append(row["expected_verdict"])
-                        per_interaction[interaction]["actual"].append(row["actual_verdict"])
-                    """
-                    
-    
+        # List CSV log files
+        csv_files += [os.path.join(device_logs_dir, csv_file) for csv_file in sorted(os.listdir(device_logs_dir))]
+
+    # Read CSV log files in parallel
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        dfs = list(executor.map(read_final_log, csv_files))
+    df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=["policy", "expected_verdict", "actual_verdict"])
+
+    # Confusion matrix per packet
+    expected = df["expected_verdict"].to_numpy()
+    actual = df["actual_verdict"].to_numpy()
+
+    # Packet verdict per policy
+    per_policy = {
+        policy: {"expected": group["expected_verdict"].to_numpy(), "actual": group["actual_verdict"].to_numpy(), "labels": labels}
+        for policy, group in df.groupby("policy", sort=False)
+    }
+
+    """
+    # Packet verdict per interaction
+    interactions = df["policy"].str.split("#").str[0]
+    per_interaction = {
+        interaction: {"expected": group["expected_verdict"].to_numpy(), "actual": group["actual_verdict"].to_numpy(), "labels": labels}
+        for interaction, group in df[interactions != "single"].groupby(interactions, sort=False)
+    }
+    """
+
     metrics["cm_per_packet"] = {"expected": expected, "actual": actual, "labels": labels}
     metrics["per_policy"] = per_policy
     metrics["per_interaction"] = per_interaction
@@ -87,17 +101,13 @@ def compute_metrics(device_pcaps: dict) -> dict:
     return metrics
 
 
-def plot_cm_per_packet(metrics: dict) -> None:
+def plot_cm_per_packet(cm: np.ndarray, labels: list) -> None:
     """
-    Compute and plot confusion matrix per packet.
+    Plot confusion matrix per packet.
 
-    :param device_pcaps: dictionary of device PCAPs
+    :param cm: confusion matrix, with expected verdicts as rows and actual verdicts as columns
+    :param labels: verdict labels, in the order of the confusion matrix
     """
-    labels = metrics["labels"]
-
-    # Compute confusion matrix
-    cm = confusion_matrix(metrics["expected"], metrics["actual"], labels=labels)
-
     # Plot confusion matrix
     plt.figure(figsize=(10, 7))
     sn.set(font_scale=1.4)
@@ -124,26 +134,36 @@ if __name__ == "__main__":
 
     metrics = compute_metrics(device_pcaps)
 
+    # Compute confusion matrix once, on integer-coded verdicts,
+    # and derive all metrics from it
+    labels = metrics["cm_per_packet"]["labels"]
+    expected = pd.Categorical(metrics["cm_per_packet"]["expected"], categories=labels).codes
+    actual = pd.Categorical(metrics["cm_per_packet"]["actual"], categories=labels).codes
+    cm = confusion_matrix(expected, actual, labels=range(len(labels)))
+    true_positives = cm.diagonal()
+    actual_counts = cm.sum(axis=0)
+    expected_counts = cm.sum(axis=1)
+
     # Compute accuracy
-    accuracy = accuracy_score(metrics["cm_per_packet"]["expected"], metrics["cm_per_packet"]["actual"], normalize=True)
+    accuracy = true_positives.sum() / cm.sum()
     print(f"Accuracy: {accuracy}")
 
     # Compute precision
-    precision = precision_score(metrics["cm_per_packet"]["expected"], metrics["cm_per_packet"]["actual"], average=None)
+    precision = np.divide(true_positives, actual_counts, out=np.zeros(len(labels)), where=actual_counts != 0)
     precision_accept = precision[0]
     precision_drop = precision[1]
     print(f"Precision: ACCEPT {precision_accept}; DROP {precision_drop}")
 
     # Compute recall
-    recall = recall_score(metrics["cm_per_packet"]["expected"], metrics["cm_per_packet"]["actual"], average=None)
+    recall = np.divide(true_positives, expected_counts, out=np.zeros(len(labels)), where=expected_counts != 0)
     recall_accept = recall[0]
     recall_drop = recall[1]
     print(f"Recall: ACCEPT {recall_accept}; DROP {recall_drop}")
 
     # Compute F1 score
-    f1 = f1_score(metrics["cm_per_packet"]["expected"], metrics["cm_per_packet"]["actual"], average=None)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(labels)), where=(precision + recall) != 0)
     f1_accept = f1[0]
     f1_drop = f1[1]
     print(f"F1 score: ACCEPT {f1_accept}; DROP {f1_drop}")
 
-    plot_cm_per_packet(metrics["cm_per_packet"])
+    plot_cm_per_packet(cm, labels)
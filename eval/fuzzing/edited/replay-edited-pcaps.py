@@ -11,6 +11,7 @@ import glob
 import json
 import re
 import subprocess
+import shlex
 import time
 import logging
 import sys
@@ -26,6 +27,11 @@ repo_name = "iot-firewall"
 firewall = "firewall.nft"
 nfqueue = "nfqueue"
 nflog = "nflog"
+device_pattern = re.compile(r".*/devices/([^/]*)/.*")  # Device name in a PCAP path
+edit_pattern = re.compile(r"\.edit-\d+")               # Edit suffix in an edited PCAP name
+# Share a single SSH connection between all ssh and scp commands:
+# the first command opens it, and following ones reuse it instead of handshaking again
+ssh_mux_options = ["-o", "ControlMaster=auto", "-o", "ControlPath=~/.ssh/cm-%C", "-o", "ControlPersist=10m"]
 
 
 def exit_cleanup(sig, frame):
@@ -33,31 +39,50 @@ def exit_cleanup(sig, frame):
     SIGINT handler, clean up and exit.
     Kill nfqueue and nflog programs, and flush firewall on target.
     """
-    # Kill nfqueue and nflog programs
-    run_cmd(f"ssh {ssh_config_file} {ssh_name} \"{sudo} killall -SIGINT {nfqueue}\"")
-    run_cmd(f"ssh {ssh_config_file} {ssh_name} \"{sudo} killall -SIGINT {nflog}\"")
-    # Flush firewall on target
-    run_cmd(f"ssh {ssh_config_file} {ssh_name} \"{sudo} nft flush ruleset\"")
+    # Kill nfqueue and nflog programs, and flush firewall on target
+    run_cmd(ssh_cmd(f"{sudo} killall -SIGINT {nfqueue}; {sudo} killall -SIGINT {nflog}; {sudo} nft flush ruleset"))
     exit()
 
 
-def run_cmd(cmd: str) -> int:
+def ssh_cmd(remote_cmd: str) -> list:
+    """
+    Build the command running a command on the target over SSH.
+
+    :param remote_cmd: command to run on the target, interpreted by the target's shell
+    :return: command, as a list of arguments
+    """
+    return ["ssh", *ssh_options, ssh_name, remote_cmd]
+
+
+def run_cmd(cmd: list) -> int:
     """
-    Run a command, and return its exit code.
+    Run a command, without going through a shell, and return its exit code.
 
-    :param cmd: command to run
+    :param cmd: command to run, as a list of arguments
     :return: exit code
     """
-    return subprocess.run(cmd, shell=True).returncode
+    return subprocess.run(cmd).returncode
+
+
+def run_cmd_background(cmd: list) -> None:
+    """
+    Run a command in the background, without going through a shell.
+
+    :param cmd: command to run, as a list of arguments
+    """
+    subprocess.Popen(cmd)
 
 
-def run_cmd_background(cmd: str) -> None:
+def run_cmds_parallel(cmds: list) -> list:
     """
-    Run a command in the background.
+    Run commands concurrently, without going through a shell,
+    wait for all of them to finish, and return their exit codes.
 
-    :param cmd: command to run
+    :param cmds: commands to run, each as a list of arguments
+    :return: exit codes, in the order of the commands
     """
-    subprocess.Popen(cmd, shell=True)
+    processes = [subprocess.Popen(cmd) for cmd in cmds]
+    return [process.wait() for process in processes]
 
 
 # Program entry point
@@ -72,7 +97,7 @@ if __name__ == "__main__":
     base_dir = script_path.parents[3]
     devices_dir = os.path.join(base_dir, "devices")
     bin_dir = os.path.join(base_dir, "bin")
-    ssh_config_file = ""
+    ssh_config_file = []
     log_group = 100
 
     ### ARGUMENT PARSING ###
@@ -101,7 +126,7 @@ if __name__ == "__main__":
     # Optional argument defaults
     if args.target == "vm":
         sudo = "sudo"
-        ssh_config_file = f"-F {os.path.join(parent_dir, 'vagrant-ssh-config')}"
+        ssh_config_file = ["-F", os.path.join(parent_dir, "vagrant-ssh-config")]
         if args.name is None:
             ssh_name = "default"
         if args.ip_addr is None:
@@ -118,17 +143,20 @@ if __name__ == "__main__":
         if args.path is None:
             args.path = os.path.join("root", repo_name)
 
+    # Options common to all ssh and scp commands
+    ssh_options = ssh_config_file + ssh_mux_options
+
     # Register SIGINT handler
     signal.signal(signal.SIGINT, exit_cleanup)
 
     # Get sudo rights
-    run_cmd("sudo -v")
+    run_cmd(["sudo", "-v"])
 
     # Flush firewall on target
-    run_cmd(f"ssh {ssh_config_file} {ssh_name} \"{sudo} nft flush ruleset\"")
+    run_cmd(ssh_cmd(f"{sudo} nft flush ruleset"))
 
     # Ping target to test connectivity
-    exit_code = run_cmd(f"ping -w 5 -I {interface} {args.ip_addr}")
+    exit_code = run_cmd(["ping", "-w", "5", "-I", interface, args.ip_addr])
     if exit_code != 0:
         logging.error(f"Cannot ping target at {args.ip_addr} from interface {interface}.")
         exit()
@@ -154,9 +182,9 @@ if __name__ == "__main__":
         # Read device PCAPs from command line arguments
         for pcap in args.input_pcaps:
             pcap_path = os.path.abspath(pcap)
-            device = re.search(r".*/devices/([^/]*)/.*", pcap_path).group(1)
+            device = device_pattern.search(pcap_path).group(1)
             pcap_basename = os.path.basename(pcap_path)
-            pcap_basename = re.sub(r"\.edit-\d", "", pcap_basename)
+            pcap_basename = edit_pattern.sub("", pcap_basename)
             device_pcaps[device] = device_pcaps.get(device, []) + [pcap_basename]
     logging.info("Read PCAP data.")
 
@@ -164,11 +192,10 @@ if __name__ == "__main__":
     ### MAIN PROGRAM ###
 
     # On target: stop nfqueue and nflog programs
-    run_cmd(f"ssh {ssh_config_file} {ssh_name} \"{sudo} killall -SIGINT {nfqueue}\"")
-    run_cmd(f"ssh {ssh_config_file} {ssh_name} \"{sudo} killall -SIGINT {nflog}\"")
+    run_cmd(ssh_cmd(f"{sudo} killall -SIGINT {nfqueue}; {sudo} killall -SIGINT {nflog}"))
 
     # Copy nflog program to target
-    run_cmd(f"scp {ssh_config_file} {os.path.join(bin_dir, nflog)} {ssh_name}:{args.path}")
+    run_cmd(["scp", *ssh_options, os.path.join(bin_dir, nflog), f"{ssh_name}:{args.path}"])
     logging.info(f"Copied {nflog} to target at {os.path.join(args.path, nflog)}")
 
     # Loop on devices
@@ -177,11 +204,11 @@ if __name__ == "__main__":
         target_device_dir = os.path.join(args.path, device)
 
         # Copy firewall script to target
-        run_cmd(f"scp {ssh_config_file} {os.path.join(device_dir, firewall)} {ssh_name}:{target_device_dir}")
+        run_cmd(["scp", *ssh_options, os.path.join(device_dir, firewall), f"{ssh_name}:{target_device_dir}"])
         logging.info(f"Copied {device} firewall to target at {os.path.join(target_device_dir, firewall)}")
         # Copy nfqueue program to target
         device_nfqueue = os.path.join(target_device_dir, nfqueue)
-        run_cmd(f"scp {ssh_config_file} {os.path.join(bin_dir, device)} {ssh_name}:{device_nfqueue}")
+        run_cmd(["scp", *ssh_options, os.path.join(bin_dir, device), f"{ssh_name}:{device_nfqueue}"])
         logging.info(f"Copied {device} {nfqueue} program to target at {device_nfqueue}")
 
         # Loop on edited PCAPs
@@ -193,61 +220,59 @@ if __name__ == "__main__":
             for edited_pcap in edited_pcaps:
 
                 # Keep-alive for sudo rights
-                run_cmd("sudo -v")
+                run_cmd(["sudo", "-v"])
 
-                # Restart firewall on target
-                run_cmd(f"ssh {ssh_config_file} {ssh_name} \"{sudo} nft flush ruleset\"")
-                logging.info("Flushed firewall on the target.")
-                run_cmd(f"ssh {ssh_config_file} {ssh_name} \"{sudo} nft -f {os.path.join(target_device_dir, firewall)}\"")
-                logging.info("Enabled firewall on the target.")
+                # Restart firewall on target, and create log directory,
+                # in a single SSH round-trip
+                target_log_dir = os.path.join(target_device_dir, "log")
+                run_cmd(ssh_cmd(f"{sudo} nft flush ruleset; {sudo} nft -f {os.path.join(target_device_dir, firewall)}; mkdir -p {target_log_dir}"))
+                logging.info("Flushed and enabled firewall on the target.")
 
                 # Start nfqueue on target
-                target_log_dir = os.path.join(target_device_dir, "log")
-                run_cmd(f"ssh {ssh_config_file} {ssh_name} \"mkdir -p {target_log_dir}\"")
                 nfq_csv_file = f"{Path(edited_pcap).stem}.nfq.csv"
                 nfq_csv_file = os.path.join(target_device_dir, target_log_dir, nfq_csv_file)
-                cmd = f"ssh {ssh_config_file} {ssh_name} \"{sudo} {os.path.join(target_device_dir, nfqueue)} > {nfq_csv_file}\""
+                cmd = ssh_cmd(f"{sudo} {os.path.join(target_device_dir, nfqueue)} > {nfq_csv_file}")
                 run_cmd_background(cmd)
-                logging.info(f"Started NFQueue program with command: {cmd}")
+                logging.info(f"Started NFQueue program with command: {shlex.join(cmd)}")
 
                 # Start nflog on target
                 nflog_csv_file = nfq_csv_file.replace("nfq", "log")
-                cmd = f"ssh {ssh_config_file} {ssh_name} \"{sudo} {os.path.join(args.path, nflog)} {log_group} {nflog_csv_file}\""
+                cmd = ssh_cmd(f"{sudo} {os.path.join(args.path, nflog)} {log_group} {nflog_csv_file}")
                 run_cmd_background(cmd)
-                logging.info(f"Started NFLog program with command: {cmd}")
+                logging.info(f"Started NFLog program with command: {shlex.join(cmd)}")
 
                 time.sleep(1)
 
                 # Replay PCAP
-                cmd = f"sudo tcpreplay-edit -T nano -i {interface} --enet-dmac={args.mac_addr} {edited_pcap}"
+                cmd = ["sudo", "tcpreplay-edit", "-T", "nano", "-i", interface, f"--enet-dmac={args.mac_addr}", edited_pcap]
                 run_cmd(cmd)
-                logging.info(f"Replayed PCAP with command: {cmd}")
+                logging.info(f"Replayed PCAP with command: {shlex.join(cmd)}")
 
                 time.sleep(1)
 
-                # Stop nfqueue on target
-                run_cmd(f"ssh {ssh_config_file} {ssh_name} \"{sudo} killall -SIGINT {nfqueue}\"")
-                # Stop nflog on target
-                run_cmd(f"ssh {ssh_config_file} {ssh_name} \"{sudo} killall -SIGINT {nflog}\"")
+                # Stop nfqueue and nflog on target
+                run_cmd(ssh_cmd(f"{sudo} killall -SIGINT {nfqueue}; {sudo} killall -SIGINT {nflog}"))
                 logging.info(f"Killed {device} {nfqueue} and {nflog}")
 
                 time.sleep(1)
 
-                # Copy CSV logs to host
+                # Copy CSV logs to host, concurrently
                 host_nfq_dir = os.path.join(script_dir, device, "nfq")
                 os.makedirs(host_nfq_dir, exist_ok=True)
-                run_cmd(f"scp {ssh_config_file} {ssh_name}:{nfq_csv_file} {host_nfq_dir}")
-                logging.info(f"Copied file {nfq_csv_file} from target to {host_nfq_dir} on host")
                 host_nflog_dir = os.path.join(script_dir, device, "nflog")
                 os.makedirs(host_nflog_dir, exist_ok=True)
-                run_cmd(f"scp {ssh_config_file} {ssh_name}:{nflog_csv_file} {host_nflog_dir}")
+                run_cmds_parallel([
+                    ["scp", *ssh_options, f"{ssh_name}:{nfq_csv_file}", host_nfq_dir],
+                    ["scp", *ssh_options, f"{ssh_name}:{nflog_csv_file}", host_nflog_dir]
+                ])
+                logging.info(f"Copied file {nfq_csv_file} from target to {host_nfq_dir} on host")
                 logging.info(f"Copied file {nflog_csv_file} from target to {host_nflog_dir} on host")
 
                 # Remove CSV logs from target
-                run_cmd(f"ssh {ssh_config_file} {ssh_name} \"rm {nfq_csv_file}\"")
-                logging.info(f"Removed file {nfq_csv_file} from target")
-                run_cmd(f"ssh {ssh_config_file} {ssh_name} \"rm {nflog_csv_file}\"")
-                logging.info(f"Removed file {nflog_csv_file} from target")
+                run_cmd(ssh_cmd(f"rm {nfq_csv_file} {nflog_csv_file}"))
+                logging.info(f"Removed files {nfq_csv_file} and {nflog_csv_file} from target")
         
     # Flush firewall on target
-    run_cmd(f"ssh {ssh_config_file} {ssh_name} \"{sudo} nft flush ruleset\"")
+    run_cmd(ssh_cmd(f"{sudo} nft flush ruleset"))
+    # Close the shared SSH connection
+    run_cmd(["ssh", *ssh_options, "-O", "exit", ssh_name])
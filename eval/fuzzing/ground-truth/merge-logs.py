@@ -8,8 +8,10 @@ import os
 from pathlib import Path
 import json
 import csv
+import bisect
+import operator
 import logging
-from typing import Union, Tuple
+from typing import Tuple
 
 # Verdict values
 ACCEPT = "ACCEPT"
@@ -17,13 +19,32 @@ DROP = "DROP"
 QUEUE = "QUEUE"
 
 
-def get_all_packets(rows: list, hash: str, timestamp: Union[float, str], start_idx: int = 0) -> Tuple[list, int]:
+def index_packets(rows: list, hash_idx: int, timestamp_idx: int) -> dict:
     """
-    Retrieve all packets from a list which have the given hash value and timestamp,
-    and represent the same packet matched with different policies.
-    As packet list is sorted, stop when packet timestamp is exceeded.
+    Index the rows of a packet list by hash value and timestamp.
+    Timestamps are compared as strings,
+    as NFLog and NFQueue rows are logged with the same timestamp format.
 
     :param rows: list of rows
+    :param hash_idx: index of the hash value column
+    :param timestamp_idx: index of the timestamp column
+    :return: dict mapping each (hash value, timestamp) pair to the sorted indices of its rows
+    """
+    index = {}
+    for i, row in enumerate(rows):
+        index.setdefault((row[hash_idx], row[timestamp_idx]), []).append(i)
+    return index
+
+
+def get_indexed_packets(rows: list, index: dict, hash: str, timestamp: str, start_idx: int = 0) -> Tuple[list, int]:
+    """
+    Retrieve all packets from a sorted list which have the given hash value and timestamp,
+    starting from the given index, using the list index built by `index_packets`.
+    These represent the same packet matched with different policies,
+    or duplicate packets sent at the same time.
+
+    :param rows: sorted list of rows
+    :param index: index of the list, as returned by `index_packets`
     :param hash: packet hash value
     :param timestamp: packet timestamp
     :param start_idx: Optional; index to start from (default: 0)
@@ -31,36 +52,28 @@ def get_all_packets(rows: list, hash: str, timestamp: Union[float, str], start_i
         - list of rows with the given hash value
         - index following the last row with the given hash value
     """
-    timestamp = float(timestamp)
-    acc = []
-    result_idx = start_idx - 1
-    i = start_idx
-    for row in rows[i:]:
-        current_timestamp = float(row["timestamp"])
-        if current_timestamp > timestamp:
-            # As packet list is sorted, stop when timestamp is exceeded
-            break
-        
-        # Timestamp is not exceeded yet
-        if row["hash"] == hash and current_timestamp == timestamp:
-            acc.append(row)
-            result_idx = i
-        i += 1
-    return acc, result_idx + 1
+    indices = index.get((hash, timestamp), [])
+    first = bisect.bisect_left(indices, start_idx)
+    if first == len(indices):
+        # No packet found
+        return [], start_idx
+    return [rows[i] for i in indices[first:]], indices[-1] + 1
 
 
-def merge_rows(nflog_row: dict, nfq_row: dict) -> dict:
+def merge_rows(nflog_row: list, nfq_row: list, columns: dict) -> list:
     """
     Merge corresponding NFLog and NFQueue rows into a single row.
 
     :param nflog_row: NFLog row
-    :param nfq_row: NFQueue row
+    :param nfq_row: NFQueue row, with the same columns as NFLog rows
+    :param columns: index of each column, by name
     :return: merged row
     """
+    id_idx, policy_idx = columns["id"], columns["policy"]
     merged_row = nfq_row.copy()
-    merged_row["id"] = nflog_row["id"]
-    if not merged_row["policy"]:
-        merged_row["policy"] = nflog_row["policy"]
+    merged_row[id_idx] = nflog_row[id_idx]
+    if not merged_row[policy_idx]:
+        merged_row[policy_idx] = nflog_row[policy_idx]
     return merged_row
 
 
@@ -103,10 +116,11 @@ if __name__ == "__main__":
         nfq_dir = os.path.join(device_logs_dir, "nfq")
         merged_logs_dir = os.path.join(device_logs_dir, "merged")
         os.makedirs(merged_logs_dir, exist_ok=True)
-        nflog_files = sorted(os.listdir(nflog_dir))
-        for nflog_file_name in nflog_files:
-            stem = Path(nflog_file_name).stem
-            nflog_file_name = os.path.join(nflog_dir, nflog_file_name)
+        with os.scandir(nflog_dir) as entries:
+            nflog_entries = sorted((entry for entry in entries if entry.is_file()), key=lambda entry: entry.name)
+        for nflog_entry in nflog_entries:
+            stem = Path(nflog_entry.name).stem
+            nflog_file_name = nflog_entry.path
             # Corresponding NFQueue log file
             nfq_file_name = os.path.join(nfq_dir, f"{stem.replace('log', 'nfq')}.csv")
             # Merged CSV log file
@@ -114,64 +128,90 @@ if __name__ == "__main__":
             
             # Open files
             logging.info(f"Open NFLog CSV file {nflog_file_name}")
-            nflog_file = open(nflog_file_name, "r")
+            nflog_file = open(nflog_file_name, "r", buffering=1 << 20, newline="")
             logging.info(f"Open NFQueue CSV file {nfq_file_name}")
-            nfq_file = open(nfq_file_name, "r")
-            logging.info(f"Open merged CSV file {merged_file_name}")
-            merged_file = open(merged_file_name, "w")
-
-            # Initialize CSV handlers
-            nflog_reader = csv.DictReader(nflog_file)
-            nfq_list = list(csv.DictReader(nfq_file))
-            nfq_list.sort(key=lambda row: row["timestamp"])
-            merged_writer = csv.DictWriter(merged_file, fieldnames=nflog_reader.fieldnames)
-            merged_writer.writeheader()
-
-            # Process NFLog file
-            nflog_list = list(nflog_reader)
-            nflog_list.sort(key=lambda row: row["timestamp"])
+            nfq_file = open(nfq_file_name, "r", buffering=1 << 20, newline="")
+
+            # Initialize CSV handlers.
+            # Rows are read as lists, and their columns are accessed by index.
+            # Blank lines are skipped.
+            nflog_reader = csv.reader(nflog_file)
+            fieldnames = next(nflog_reader)
+            columns = {name: idx for idx, name in enumerate(fieldnames)}
+            hash_idx, timestamp_idx, verdict_idx = (columns[name] for name in ("hash", "timestamp", "verdict"))
+            nfq_reader = csv.reader(nfq_file)
+            nfq_fieldnames = next(nfq_reader)
+            # Lay NFQueue rows out with the NFLog columns,
+            # leaving the columns NFQueue does not log (i.e. the packet ID) empty
+            nfq_columns = [nfq_fieldnames.index(name) if name in nfq_fieldnames else None for name in fieldnames]
+            nfq_list = [[row[idx] if idx is not None else "" for idx in nfq_columns] for row in nfq_reader if row]
+            nfq_list.sort(key=operator.itemgetter(timestamp_idx))
+
+            # Process NFLog file, collecting merged rows to write them at once
+            nflog_list = [row for row in nflog_reader if row]
+            nflog_list.sort(key=operator.itemgetter(timestamp_idx))
+            # Index both lists once by hash value and timestamp
+            nflog_index = index_packets(nflog_list, hash_idx, timestamp_idx)
+            nfq_index = index_packets(nfq_list, hash_idx, timestamp_idx)
+            # Positions of the rows which have the QUEUE verdict
+            queue_row_idxs = [idx for idx, row in enumerate(nflog_list) if row[verdict_idx] == QUEUE]
+            merged_rows = []
             nflog_row_idx = 0
             nfq_row_idx = 0
-            while nflog_row_idx < len(nflog_list):
-                nflog_row = nflog_list[nflog_row_idx]
-
-                # Rows which do not have the QUEUE verdict: write as is
-                if nflog_row["verdict"] != QUEUE:
-                    merged_writer.writerow(nflog_row)
-                    logging.info(f"Wrote nflog row as is: {nflog_row}.")
-                    nflog_row_idx += 1
+            for queue_row_idx in queue_row_idxs:
+                if queue_row_idx < nflog_row_idx:
+                    # Row already merged with a previous row with the same hash and timestamp
                     continue
 
-                # Rows which have the QUEUE verdict: merge with corresponding NFQueue row
-                hash = nflog_row["hash"]
-                timestamp = float(nflog_row["timestamp"])
+                # Rows which do not have the QUEUE verdict, up to this one: write as is
+                merged_rows.extend(nflog_list[nflog_row_idx:queue_row_idx])
+                logging.debug("Merged %d nflog rows as is.", queue_row_idx - nflog_row_idx)
+                nflog_row = nflog_list[queue_row_idx]
+                nflog_row_idx = queue_row_idx
+
+                # Rows which have the QUEUE verdict: merge with corresponding NFQueue row.
+                # Duplicate packets are paired with NFQueue rows by position,
+                # and NFQueue rows are consumed in order,
+                # so this is not a plain join on hash value and timestamp.
+                hash = nflog_row[hash_idx]
+                timestamp = nflog_row[timestamp_idx]
 
                 # Get all NFLog rows with the same hash and timestamp
                 # (i.e. duplicate packets sent at the same time)
-                nflog_rows, nflog_row_idx = get_all_packets(nflog_list, hash, timestamp, nflog_row_idx)
+                nflog_rows, nflog_row_idx = get_indexed_packets(nflog_list, nflog_index, hash, timestamp, nflog_row_idx)
                 
                 # Get all corresponding NFQueue rows with the same hash and timestamp
-                nfq_rows, nfq_row_idx = get_all_packets(nfq_list, hash, timestamp, nfq_row_idx)
+                nfq_rows, nfq_row_idx = get_indexed_packets(nfq_list, nfq_index, hash, timestamp, nfq_row_idx)
 
                 if len(nfq_rows) == 0:
-                    logging.warning(f"NFQueue row not found for NFLog row with hash {nflog_row['hash']} and timestamp {nflog_row['timestamp']}")
+                    logging.warning(f"NFQueue row not found for NFLog row with hash {hash} and timestamp {timestamp}")
 
                 elif len(nflog_rows) == len(nfq_rows):
                     # Each packet was matched with a single policy
                     for nflog_row, nfq_row in zip(nflog_rows, nfq_rows):
-                        merged_row = merge_rows(nflog_row, nfq_row)
-                        merged_writer.writerow(merged_row)
-                        logging.info(f"Wrote merged row: {merged_row}.")
+                        merged_row = merge_rows(nflog_row, nfq_row, columns)
+                        merged_rows.append(merged_row)
+                        logging.debug("Merged row: %s.", merged_row)
 
                 elif len(nflog_rows) == 1 and len(nfq_rows) > 1:
                     # One packet was matched with multiple policies
                     for nfq_row in nfq_rows:
-                        merged_row = merge_rows(nflog_row, nfq_row)
-                        merged_writer.writerow(merged_row)
-                        logging.info(f"Wrote merged row: {merged_row}.")
+                        merged_row = merge_rows(nflog_row, nfq_row, columns)
+                        merged_rows.append(merged_row)
+                        logging.debug("Merged row: %s.", merged_row)
+
+            # Remaining rows, which do not have the QUEUE verdict: write as is
+            merged_rows.extend(nflog_list[nflog_row_idx:])
+            logging.debug("Merged %d nflog rows as is.", len(nflog_list) - nflog_row_idx)
 
-            # Close files
+            # Close input files
             nflog_file.close()
             nfq_file.close()
-            merged_file.close()
+
+            # Write merged file
+            logging.info(f"Open merged CSV file {merged_file_name}")
+            with open(merged_file_name, "w", buffering=1 << 20) as merged_file:
+                merged_writer = csv.writer(merged_file)
+                merged_writer.writerow(fieldnames)
+                merged_writer.writerows(merged_rows)
             logging.info(f"Closed all CSV files.")
@@ -2,10 +2,10 @@
 
 import argparse
 import os
+import importlib.util
 import sys
-import re
-from inspect import getmembers, isfunction
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sn
@@ -15,6 +15,8 @@ import seaborn as sn
 script_name = os.path.basename(__file__)
 script_path = Path(os.path.abspath(__file__))
 script_dir = script_path.parents[0]
+csv_engine = "pyarrow" if importlib.util.find_spec("pyarrow") is not None else "c"
+plot_types = ["bar", "box", "violin", "scatter", "point"]
 devices = [
     "dlink-cam",
     "philips-hue",
@@ -40,28 +42,33 @@ def build_df(devices: list) -> pd.DataFrame:
     :param devices: list of devices
     :return: pandas DataFrame containing the latency data per device and scenario
     """
-    # Result DataFrame, will be populated
+    # Result DataFrame, will be populated from one DataFrame per device and scenario
     columns = ["device", "scenario", "latency"]
-    df = pd.DataFrame(columns=columns)
+    frames = []
+    # Device and scenario columns are categorical, storing one small integer code per row
+    device_dtype = pd.CategoricalDtype(devices)
+    scenario_dtype = pd.CategoricalDtype(scenarios)
 
     # Iterate over devices and scenarios
-    for device in devices:
+    for device_code, device in enumerate(devices):
         # Read timestamp list from CSV file
         device_path = os.path.join(script_dir, device)
-        for scenario in scenarios:
+        for scenario_code, scenario in enumerate(scenarios):
             scenario_path = os.path.join(device_path, scenario)
             if os.path.isdir(scenario_path) and len(os.listdir(scenario_path)):
                 csv_file_name = f"{device}_{scenario}.csv"
                 csv_file_path = os.path.join(scenario_path, csv_file_name)
-                scenario_df = pd.read_csv(csv_file_path)
+                scenario_df = pd.read_csv(csv_file_path, engine=csv_engine, usecols=["latency"])
+                n_rows = len(scenario_df)
                 tmp_df = pd.DataFrame({
-                    "device": [device]*len(scenario_df),
-                    "scenario": [scenario]*len(scenario_df),
-                    "latency": scenario_df["latency"].apply(lambda x: x*1000)  # Convert to milliseconds
+                    "device": pd.Categorical.from_codes(np.full(n_rows, device_code), dtype=device_dtype),
+                    "scenario": pd.Categorical.from_codes(np.full(n_rows, scenario_code), dtype=scenario_dtype),
+                    "latency": scenario_df["latency"].to_numpy() * 1000  # Convert to milliseconds
                 })
-                df = pd.concat([df, tmp_df], ignore_index=True)
-    
-    return df
+                frames.append(tmp_df)
+
+    # Concatenate all DataFrames at once
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
 
 
 def bar_plot(df: pd.DataFrame, ax: plt.Axes) -> None:
@@ -174,14 +181,17 @@ if __name__ == "__main__":
         description="Plot latency values for each device and scenario."
     )
     # Optional argument #1: plot type
-    pattern = re.compile(r"^(.*)_plot$")
-    plot_types = [func[0].split("_")[0] for func in getmembers(sys.modules[__name__], isfunction) if pattern.match(func[0]) is not None]
     parser.add_argument("-p", "--plot-type", type=str, choices=plot_types, default="bar", help="Plot type")
     # Optional argument #2: file to save the plot to
     parser.add_argument("-f", "--file", type=str, help="File to save the plot to")
     # Parse arguments
     args = parser.parse_args()
 
+    # No plot is shown on screen when it is saved to a file:
+    # use the non-interactive backend, to skip loading a GUI toolkit
+    if args.file:
+        plt.switch_backend("agg")
+
 
     ### PLOTS ###
 
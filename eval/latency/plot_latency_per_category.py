@@ -2,11 +2,11 @@
 
 import argparse
 import os
+import importlib.util
 import sys
-import re
-from inspect import getmembers, isfunction
 from pathlib import Path
 from enum import Enum
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sn
@@ -16,7 +16,9 @@ import seaborn as sn
 script_name = os.path.basename(__file__)
 script_path = Path(os.path.abspath(__file__))
 script_dir = script_path.parents[0]
+csv_engine = "pyarrow" if importlib.util.find_spec("pyarrow") is not None else "c"
 scenario = "my-firewall"
+plot_types = ["bar", "box", "violin", "scatter", "point"]
 devices = [
     "dlink-cam",
     "philips-hue",
@@ -40,26 +42,35 @@ def build_df(devices: list) -> pd.DataFrame:
     :param devices: list of devices
     :return: pandas DataFrame containing the latency data per device and category
     """
-    # Result DataFrame, will be populated
+    # Result DataFrame, will be populated from one DataFrame per device and category
     columns = ["device", "category", "latency"]
-    df = pd.DataFrame(columns=columns)
+    frames = []
+    # Device and category columns are categorical, storing one small integer code per row
+    device_dtype = pd.CategoricalDtype(devices)
+    category_dtype = pd.CategoricalDtype([category.name for category in ProtocolCategory])
 
     # Iterate over devices and categories
-    for device in devices:
+    for device_code, device in enumerate(devices):
         # Read latency from CSV file
         csv_file_name = f"{device}_{scenario}.csv"
         csv_file_path = os.path.join(script_dir, device, scenario, csv_file_name)
-        scenario_df = pd.read_csv(csv_file_path)
+        scenario_df = pd.read_csv(csv_file_path, engine=csv_engine, usecols=["protocol_category", "latency"])
+        # Split rows per category in a single pass
+        category_dfs = dict(tuple(scenario_df.groupby("protocol_category")))
         for category in ProtocolCategory:
-            category_df = scenario_df[scenario_df["protocol_category"] == category.name]
+            if category.name not in category_dfs:
+                continue
+            category_df = category_dfs[category.name]
+            n_rows = len(category_df)
             tmp_df = pd.DataFrame({
-                "device": [device]*len(category_df),
-                "category": [category.name]*len(category_df),
-                "latency": category_df["latency"].apply(lambda x: x*1000)  # Convert to milliseconds
+                "device": pd.Categorical.from_codes(np.full(n_rows, device_code), dtype=device_dtype),
+                "category": pd.Categorical.from_codes(np.full(n_rows, category.value), dtype=category_dtype),
+                "latency": category_df["latency"].to_numpy() * 1000  # Convert to milliseconds
             })
-            df = pd.concat([df, tmp_df], ignore_index=True)
-    
-    return df
+            frames.append(tmp_df)
+
+    # Concatenate all DataFrames at once
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
 
 
 def bar_plot(df: pd.DataFrame, ax: plt.Axes) -> None:
@@ -166,12 +177,16 @@ def save_data(df: pd.DataFrame, data_file: str) -> None:
     """
     Compute mean and 95-percentile interval of the latency,
     per device and per category,
-    and save the data to a CSV file.
+    and save the data to a CSV file,
+    or to a Parquet file if its name ends with `.parquet`.
 
     :param df: pandas DataFrame containing the latency data per device and category
     :param data_file: file to save the data to
     """
-    df.to_csv(data_file, index=False)
+    if data_file.endswith(".parquet"):
+        df.to_parquet(data_file, index=False)
+    else:
+        df.to_csv(data_file, index=False)
 
 
 # Program entry point
@@ -184,16 +199,19 @@ if __name__ == "__main__":
         description="Plot latency values for each device and category."
     )
     # Optional argument #1: plot or save plot data
-    parser.add_argument("-d", "--data-file", type=str, help="Do not plot, but save plot data to given file")
+    parser.add_argument("-d", "--data-file", type=str, help="Do not plot, but save plot data to given file (CSV, or Parquet if it ends with .parquet)")
     # Optional argument #2: plot type
-    pattern = re.compile(r"^(.*)_plot$")
-    plot_types = [func[0].split("_")[0] for func in getmembers(sys.modules[__name__], isfunction) if pattern.match(func[0]) is not None]
     parser.add_argument("-p", "--plot-type", type=str, choices=plot_types, default="bar", help="Plot type")
     # Optional argument #3: file to save the plot to
     parser.add_argument("-f", "--file", type=str, help="File to save the plot to")
     # Parse arguments
     args = parser.parse_args()
 
+    # No plot is shown on screen when it is saved to a file, or not drawn at all:
+    # use the non-interactive backend, to skip loading a GUI toolkit
+    if args.file or args.data_file:
+        plt.switch_backend("agg")
+
 
     ### PLOTS ###
 
@@ -3,8 +3,6 @@
 import argparse
 import os
 import sys
-import re
-from inspect import getmembers, isfunction
 from pathlib import Path
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -15,6 +13,7 @@ import seaborn as sn
 script_name = os.path.basename(__file__)
 script_path = Path(os.path.abspath(__file__))
 script_dir = script_path.parents[0]
+plot_types = ["bar", "box", "violin", "scatter", "point"]
 devices = [
     "dlink-cam",
     "philips-hue",
@@ -74,7 +73,7 @@ def build_df(devices: list) -> pd.DataFrame:
                 tmp_df = pd.DataFrame({
                     "device": [device]*len(scenario_df),
                     "scenario": [scenario]*len(scenario_df),
-                    "latency": scenario_df["latency"].apply(lambda x: x*1000)  # Convert to milliseconds
+                    "latency": scenario_df["latency"] * 1000  # Convert to milliseconds
                 })
                 df = pd.concat([df, tmp_df], ignore_index=True)
         
@@ -85,7 +84,7 @@ def build_df(devices: list) -> pd.DataFrame:
         tmp_df = pd.DataFrame({
             "device": [device]*len(filtered_df),
             "scenario": ["all-devices"]*len(filtered_df),
-            "latency": filtered_df["latency"].apply(lambda x: x*1000)  # Convert to milliseconds
+            "latency": filtered_df["latency"] * 1000  # Convert to milliseconds
         })
         df = pd.concat([df, tmp_df], ignore_index=True)
     
@@ -251,8 +250,6 @@ if __name__ == "__main__":
     # Optional argument #2: plot or save plot data
     parser.add_argument("-d", "--data-file", type=str, help="Do not plot, but save plot data to given file")
     # Optional argument #3: plot type
-    pattern = re.compile(r"^(.*)_plot$")
-    plot_types = [func[0].split("_")[0] for func in getmembers(sys.modules[__name__], isfunction) if pattern.match(func[0]) is not None]
     parser.add_argument("-p", "--plot-type", type=str, choices=plot_types, default="bar", help="Plot type")
     # Optional argument #4: file to save the plot to
     parser.add_argument("-f", "--file", type=str, help="File to save the plot to")
@@ -56,7 +56,7 @@ def build_df(devices: list) -> pd.DataFrame:
             tmp_df = pd.DataFrame({
                 "device": [device]*len(category_df),
                 "category": [category.name]*len(category_df),
-                "latency": category_df["latency"].apply(lambda x: x*1000)  # Convert to milliseconds
+                "latency": category_df["latency"] * 1000  # Convert to milliseconds
             })
             df = pd.concat([df, tmp_df], ignore_index=True)
     
@@ -85,7 +85,7 @@ def build_benign_df(devices: list) -> pd.DataFrame:
                 tmp_df = pd.DataFrame({
                     "device": [device]*len(scenario_df),
                     "scenario": [scenario]*len(scenario_df),
-                    "latency": scenario_df["latency"].apply(lambda x: x*1000)  # Convert to milliseconds
+                    "latency": scenario_df["latency"] * 1000  # Convert to milliseconds
                 })
                 df = pd.concat([df, tmp_df], ignore_index=True)
         
@@ -96,7 +96,7 @@ def build_benign_df(devices: list) -> pd.DataFrame:
         tmp_df = pd.DataFrame({
             "device": [device]*len(filtered_df),
             "scenario": ["all-devices"]*len(filtered_df),
-            "latency": filtered_df["latency"].apply(lambda x: x*1000)  # Convert to milliseconds
+            "latency": filtered_df["latency"] * 1000  # Convert to milliseconds
         })
         df = pd.concat([df, tmp_df], ignore_index=True)
     
@@ -124,7 +124,7 @@ def build_attack_df(exp_cases: dict) -> pd.DataFrame:
             scenario_df = pd.read_csv(csv_file_path)
             tmp_df = pd.DataFrame({
                 "scenario": [scenario]*len(scenario_df),
-                "latency": scenario_df["latency"].apply(lambda x: x*1000)  # Convert to milliseconds
+                "latency": scenario_df["latency"] * 1000  # Convert to milliseconds
             })
             df = pd.concat([df, tmp_df], ignore_index=True)
     